@@ -1,5 +1,25 @@
 from django.apps import AppConfig
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def clear_cache(sender, **kwargs):
+    """Сброс общего кэша после миграций.
+
+    Кэш переживает перезапуск процессов, а в нем лежат экземпляры
+    моделей и счетчики, построенные по старой схеме и данным.
+    """
+    cache.clear()
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .slow_queries import flush, install
+
+        post_migrate.connect(clear_cache, sender=self)
+        connection_created.connect(install)
+        request_finished.connect(flush)
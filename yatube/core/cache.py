@@ -0,0 +1,482 @@
+import os
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .cache_stats import raw_key, stats
+from .timing import timed
+
+# Время последнего чтения обновляется не чаще раза в ACCESS_RESOLUTION
+# секунд, чтобы чтения не превращались в запись.
+ACCESS_RESOLUTION = 1
+# Ограничение числа параметров одного запроса в старых версиях SQLite.
+MAX_VARIABLES = 500
+INT64 = range(-2 ** 63, 2 ** 63)
+# Локальные уровни TieredCache, общие для потоков процесса.
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+def chunks(items, size=MAX_VARIABLES):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite в режиме WAL, общий для процессов сервера.
+
+    Записи, не читавшиеся дольше других, вытесняются при превышении
+    MAX_ENTRIES. Число записей проверяется раз в CULL_EVERY записей
+    (по умолчанию сотая часть MAX_ENTRIES), поэтому предел
+    приблизительный. Целые числа хранятся как INTEGER, поэтому incr
+    выполняется одним UPDATE без гонок между процессами.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._location = location
+        options = params.get('OPTIONS', {})
+        self._busy_timeout = options.get('BUSY_TIMEOUT', 5)
+        self._stats = options.get('STATS', False)
+        self._cull_every = options.get(
+            'CULL_EVERY', max(self._max_entries // 100, 1),
+        )
+        self._writes = 0
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        """Соединение своего потока, после fork открывается заново."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.db = self._connect()
+            local.pid = os.getpid()
+
+        return local.db
+
+    def _connect(self):
+        directory = os.path.dirname(self._location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(
+            self._location,
+            timeout=self._busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL'
+            ') WITHOUT ROWID'
+        )
+        db.execute(
+            'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)'
+        )
+
+        return db
+
+    @contextmanager
+    def _write(self):
+        """Транзакция с блокировкой записи с самого начала."""
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        return key
+
+    @staticmethod
+    def _encode(value):
+        if type(value) is int and value in INT64:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _decode(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _set(self, db, entries, timeout, now):
+        expires = self.get_backend_timeout(timeout)
+        rows = [
+            (key, self._encode(value), expires, now)
+            for key, value in entries.items()
+        ]
+        db.executemany(
+            'REPLACE INTO cache (key, value, expires, accessed) '
+            'VALUES (?, ?, ?, ?)',
+            rows,
+        )
+        if self._stats:
+            stats.add('bytes_written', self._sizes(rows))
+
+    @staticmethod
+    def _sizes(rows):
+        return (
+            (raw_key(key), len(value) if isinstance(value, bytes) else 8)
+            for key, value, *_ in rows
+        )
+
+    def _cull(self, db, now):
+        """Вытеснение истекших, затем давно не читавшихся записей."""
+        self._writes += 1
+        if self._writes < self._cull_every:
+            return
+        self._writes = 0
+        count, = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        count -= db.execute(
+            'DELETE FROM cache WHERE expires <= ?', (now,),
+        ).rowcount
+        if count <= self._max_entries:
+            return
+        if not self._cull_frequency:
+            db.execute('DELETE FROM cache')
+            return
+        victims = [
+            key for key, in db.execute(
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?',
+                (count // self._cull_frequency,),
+            )
+        ]
+        for chunk in chunks(victims):
+            marks = ', '.join('?' * len(chunk))
+            db.execute(f'DELETE FROM cache WHERE key IN ({marks})', chunk)
+        if self._stats:
+            stats.count('evictions', map(raw_key, victims))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time()
+        with self._write() as db:
+            row = (key, self._encode(value), self.get_backend_timeout(timeout))
+            added = db.execute(
+                'INSERT INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET '
+                'value = excluded.value, expires = excluded.expires, '
+                'accessed = excluded.accessed '
+                'WHERE cache.expires <= ?',
+                (*row, now, now),
+            ).rowcount
+            if added:
+                self._cull(db, now)
+                if self._stats:
+                    stats.add('bytes_written', self._sizes([row]))
+
+        return bool(added)
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        now = time()
+        found = {}
+        for chunk in chunks(keys):
+            marks = ', '.join('?' * len(chunk))
+            rows = self._db.execute(
+                f'SELECT key, value, accessed FROM cache '
+                f'WHERE key IN ({marks}) '
+                f'AND (expires IS NULL OR expires > ?)',
+                (*chunk, now),
+            ).fetchall()
+            stale = [
+                key for key, _, accessed in rows
+                if accessed < now - ACCESS_RESOLUTION
+            ]
+            if stale:
+                marks = ', '.join('?' * len(stale))
+                self._db.execute(
+                    f'UPDATE cache SET accessed = ? WHERE key IN ({marks})',
+                    (now, *stale),
+                )
+            found.update(
+                (keys[key], self._decode(value)) for key, value, _ in rows
+            )
+            if self._stats:
+                stats.add('bytes_read', self._sizes(rows))
+
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        entries = {
+            self._key(key, version): value for key, value in data.items()
+        }
+        now = time()
+        with self._write() as db:
+            self._set(db, entries, timeout, now)
+            self._cull(db, now)
+
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as db:
+            return bool(db.execute(
+                'UPDATE cache SET expires = ? '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), key, time()),
+            ).rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        now = time()
+        with self._write() as db:
+            updated = db.execute(
+                "UPDATE cache SET value = value + ?, accessed = ? "
+                "WHERE key = ? AND typeof(value) = 'integer' "
+                "AND (expires IS NULL OR expires > ?)",
+                (delta, now, key, now),
+            ).rowcount
+            if not updated:
+                raise ValueError(f"Key '{key}' not found")
+            value, = db.execute(
+                'SELECT value FROM cache WHERE key = ?', (key,),
+            ).fetchone()
+
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+
+        return self._db.execute(
+            'SELECT 1 FROM cache '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        with self._write() as db:
+            for chunk in chunks(keys):
+                marks = ', '.join('?' * len(chunk))
+                db.execute(
+                    f'DELETE FROM cache WHERE key IN ({marks})', chunk,
+                )
+
+    def clear(self):
+        with self._write() as db:
+            db.execute('DELETE FROM cache')
+
+
+class LocalTier:
+    """Ограниченный LRU-словарь процесса с коротким временем жизни."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys, now):
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                value, expires = entry
+                if expires <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = value
+
+        return found
+
+    def set_many(self, data, expires):
+        """Запись значений, возвращает вытесненные ключи."""
+        evicted = []
+        with self.lock:
+            for key, value in data.items():
+                self.entries[key] = (value, expires)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                evicted.append(self.entries.popitem(last=False)[0])
+
+        return evicted
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TieredCache(BaseCache):
+    """Локальный LRU процесса перед общим кэшем LOCATION.
+
+    Прочитанные значения хранятся в процессе LOCAL_TIMEOUT секунд
+    без повторного чтения и распаковки, поэтому их нельзя изменять
+    на месте. Ключи с префиксами из SHARED_PREFIXES всегда читаются
+    из общего кэша: через версии в них изменения из других процессов
+    становятся видны сразу, остальные - не позже LOCAL_TIMEOUT.
+    С STATS обращения считаются в core.cache_stats.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._shared_prefixes = tuple(
+            options.get('SHARED_PREFIXES', ('version:', 'lock:', 'stats:'))
+        )
+        self._stats = options.get('STATS', False)
+        with _local_tiers_lock:
+            self._local = _local_tiers.setdefault(
+                location, LocalTier(options.get('LOCAL_MAX_ENTRIES', 1000)),
+            )
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_key(self, key, version):
+        if key.startswith(self._shared_prefixes):
+            return None
+        return self.shared.make_key(key, version=version)
+
+    def _remember(self, data, version, timeout=DEFAULT_TIMEOUT):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            timeout = self._local_timeout
+        elif timeout <= 0:
+            return
+        else:
+            timeout = min(timeout, self._local_timeout)
+        local = {}
+        for key, value in data.items():
+            local_key = self._local_key(key, version)
+            if local_key is not None:
+                local[local_key] = value
+        evicted = self._local.set_many(local, time() + timeout)
+        if self._stats and evicted:
+            stats.count('local_evictions', map(raw_key, evicted))
+
+    def _forget(self, keys, version):
+        self._local.delete_many(
+            self.shared.make_key(key, version=version) for key in keys
+        )
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    @timed('cache')
+    def get_many(self, keys, version=None):
+        local_keys = {}
+        for key in keys:
+            local_key = self._local_key(key, version)
+            if local_key is not None:
+                local_keys[local_key] = key
+        found = {
+            local_keys[local_key]: value
+            for local_key, value in self._local.get_many(
+                local_keys, time(),
+            ).items()
+        }
+        missing = [key for key in keys if key not in found]
+        loaded = {}
+        if missing:
+            started = perf_counter()
+            loaded = self.shared.get_many(missing, version=version)
+            if self._stats:
+                stats.timing(missing, perf_counter() - started)
+            self._remember(loaded, version)
+        if self._stats:
+            stats.count('local_hits', found)
+            stats.count('hits', loaded)
+            stats.count(
+                'misses', [key for key in missing if key not in loaded],
+            )
+            stats.maybe_flush(self.shared)
+        found.update(loaded)
+
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    @timed('cache')
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        started = perf_counter()
+        failed = self.shared.set_many(data, timeout, version=version)
+        if self._stats:
+            stats.timing(data, perf_counter() - started)
+            stats.count('sets', data)
+        self._forget(data, version)
+        self._remember(
+            {
+                key: value for key, value in data.items()
+                if key not in (failed or ())
+            },
+            version,
+            timeout,
+        )
+
+        return failed
+
+    @timed('cache')
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._remember({key: value}, version, timeout)
+            if self._stats:
+                stats.count('sets', [key])
+
+        return added
+
+    @timed('cache')
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    @timed('cache')
+    def incr(self, key, delta=1, version=None):
+        self._forget([key], version)
+
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return key in self.get_many([key], version=version)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    @timed('cache')
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._forget(keys, version)
+        self.shared.delete_many(keys, version=version)
+        if self._stats:
+            stats.count('deletes', keys)
+
+    @timed('cache')
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
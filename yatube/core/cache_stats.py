@@ -0,0 +1,127 @@
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from .snapshots import ProcessSnapshots
+
+# Верхние границы корзин гистограммы задержек, миллисекунды.
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, float('inf'))
+COUNTERS = (
+    'local_hits',
+    'hits',
+    'misses',
+    'sets',
+    'deletes',
+    'local_evictions',
+    'evictions',
+    'bytes_read',
+    'bytes_written',
+)
+STATS_TIMEOUT = 60 * 60 * 24
+KEY_PARTS = re.compile(r'\|\|?|:')
+
+
+def raw_key(key):
+    """Ключ без префикса и версии, добавленных default_key_func."""
+    return key.split(':', 2)[-1]
+
+
+def family(key):
+    """Семейство ключа: префикс до первой части с id или хешем."""
+    if key.startswith('template.cache.'):
+        return f'fragment:{key.split(".")[2]}'
+    parts = []
+    for part in KEY_PARTS.split(key)[:2]:
+        if not part or any(char.isdigit() for char in part):
+            break
+        parts.append(part)
+
+    return ':'.join(parts) or 'other'
+
+
+class CacheStats(ProcessSnapshots):
+    """Счетчики обращений к кэшу процесса по семействам ключей."""
+
+    timeout = STATS_TIMEOUT
+
+    def __init__(self):
+        super().__init__('stats')
+
+    def clear(self):
+        self.families = defaultdict(Counter)
+
+    def snapshot(self):
+        return {
+            name: dict(counters) for name, counters in self.families.items()
+        }
+
+    def count(self, counter, keys, value=1):
+        self.check_fork()
+        with self.lock:
+            for key in keys:
+                self.families[family(key)][counter] += value
+
+    def add(self, counter, sizes):
+        """Сумма значений по ключам, sizes - пары (ключ, значение)."""
+        self.check_fork()
+        with self.lock:
+            for key, size in sizes:
+                self.families[family(key)][counter] += size
+
+    def timing(self, keys, seconds):
+        self.check_fork()
+        bucket = bisect_left(LATENCY_BUCKETS, seconds * 1000)
+        with self.lock:
+            for name in {family(key) for key in keys}:
+                self.families[name][f'latency:{bucket}'] += 1
+
+
+stats = CacheStats()
+
+
+def collect(cache):
+    """Сумма снимков всех процессов по семействам."""
+    families = defaultdict(Counter)
+    for snapshot in stats.collect(cache):
+        for name, counters in snapshot.items():
+            families[name].update(counters)
+
+    return families
+
+
+def reset(cache):
+    """Сброс статистики кэша во всех процессах."""
+    stats.reset_all(cache)
+
+
+def percentile(histogram, share):
+    """Верхняя граница корзины, в которую попадает доля share."""
+    total = sum(histogram)
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram):
+        seen += count
+        if seen >= total * share:
+            return bound
+
+
+def report(families):
+    """Строки отчета по семействам, самые читаемые сначала."""
+    rows = []
+    for name, counters in families.items():
+        row = {'family': name, **{key: counters[key] for key in COUNTERS}}
+        reads = row['local_hits'] + row['hits'] + row['misses']
+        row['reads'] = reads
+        row['hit_ratio'] = (
+            (row['local_hits'] + row['hits']) / reads if reads else None
+        )
+        row['latency'] = [
+            counters[f'latency:{bucket}']
+            for bucket in range(len(LATENCY_BUCKETS))
+        ]
+        row['p50'] = percentile(row['latency'], 0.5)
+        row['p95'] = percentile(row['latency'], 0.95)
+        rows.append(row)
+
+    return sorted(rows, key=lambda row: (-row['reads'], row['family']))
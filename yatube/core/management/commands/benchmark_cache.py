@@ -0,0 +1,96 @@
+import os
+import tempfile
+from multiprocessing import Pool
+from time import perf_counter
+
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache import SQLiteCache
+
+VALUE = {'text': 'x' * 500, 'numbers': list(range(20))}
+
+
+def run(cache, operations):
+    """Операций в секунду для set, get и incr."""
+    keys = [f'key:{number}' for number in range(operations)]
+    cache.set('counter', 0)
+    timings = {}
+    for name, operation in (
+        ('set', lambda key: cache.set(key, VALUE)),
+        ('get', cache.get),
+        ('incr', lambda key: cache.incr('counter')),
+    ):
+        started = perf_counter()
+        for key in keys:
+            operation(key)
+        timings[name] = operations / (perf_counter() - started)
+
+    return timings
+
+
+def make_cache(backend, location, entries):
+    params = {'OPTIONS': {'MAX_ENTRIES': entries}}
+    if backend == 'locmem':
+        return LocMemCache(location, params)
+    return SQLiteCache(location, params)
+
+
+def worker(args):
+    backend, location, operations, entries = args
+    cache = make_cache(backend, location, entries)
+    started = perf_counter()
+    for number in range(operations):
+        cache.set(f'{os.getpid()}:{number}', VALUE)
+        cache.get(f'{os.getpid()}:{number}')
+        try:
+            cache.incr('shared')
+        except ValueError:
+            cache.add('shared', 1)
+
+    return operations * 3 / (perf_counter() - started)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость SQLiteCache и LocMemCache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operations',
+            type=int,
+            default=5000,
+            help='Число операций каждого вида.',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Число процессов для проверки общего доступа.',
+        )
+
+    def handle(self, *args, **options):
+        operations = options['operations']
+        processes = options['processes']
+        entries = operations * (processes + 1) * 2
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, 'cache.sqlite3')
+            for backend in ('locmem', 'sqlite'):
+                cache = make_cache(backend, location, entries)
+                cache.clear()
+                timings = run(cache, operations)
+                self.stdout.write(f'{backend}: ' + ', '.join(
+                    f'{name} {rate:.0f} оп/с'
+                    for name, rate in timings.items()
+                ))
+                cache.set('shared', 0)
+                with Pool(processes) as pool:
+                    rates = pool.map(
+                        worker,
+                        [(backend, location, operations, entries)]
+                        * processes,
+                    )
+                self.stdout.write(
+                    f'{backend}, {processes} процессов: '
+                    f'{sum(rates):.0f} оп/с, общий счетчик '
+                    f'{cache.get("shared")} из {operations * processes}'
+                )
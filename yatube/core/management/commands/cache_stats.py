@@ -0,0 +1,79 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from core import cache_stats
+
+COLUMNS = (
+    ('family', 'семейство'),
+    ('local_hits', 'лок.попад.'),
+    ('hits', 'попад.'),
+    ('misses', 'промахи'),
+    ('hit_ratio', 'доля'),
+    ('sets', 'записи'),
+    ('deletes', 'удал.'),
+    ('local_evictions', 'лок.вытесн.'),
+    ('evictions', 'вытесн.'),
+    ('bytes_read', 'прочит.'),
+    ('bytes_written', 'запис.'),
+    ('p50', 'p50,мс'),
+    ('p95', 'p95,мс'),
+)
+
+
+def cell(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.2f}'
+    return str(value)
+
+
+def finite(value):
+    """Бесконечная граница последней корзины как строка для JSON."""
+    return str(value) if value == float('inf') else value
+
+
+class Command(BaseCommand):
+    help = 'Выводит статистику кэша по семействам ключей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Вывод в JSON.',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Сбросить накопленную статистику после вывода.',
+        )
+
+    def handle(self, *args, **options):
+        shared = getattr(cache, 'shared', cache)
+        rows = cache_stats.report(cache_stats.collect(shared))
+        if options['json']:
+            for row in rows:
+                row['p50'], row['p95'] = map(finite, (row['p50'], row['p95']))
+            self.stdout.write(json.dumps(
+                {
+                    'buckets': list(
+                        map(finite, cache_stats.LATENCY_BUCKETS)
+                    ),
+                    'families': rows,
+                },
+                ensure_ascii=False,
+                indent=2,
+            ))
+        else:
+            table = [[title for _, title in COLUMNS]] + [
+                [cell(row[name]) for name, _ in COLUMNS] for row in rows
+            ]
+            widths = [max(map(len, column)) for column in zip(*table)]
+            for line in table:
+                self.stdout.write('  '.join(
+                    value.rjust(width) for value, width in zip(line, widths)
+                ))
+        if options['reset']:
+            cache_stats.reset(shared)
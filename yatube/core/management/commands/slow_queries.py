@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import slow_queries
+
+
+class Command(BaseCommand):
+    help = 'Выводит самые затратные медленные запросы к базе.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Число запросов в отчете.',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Вывод в JSON.',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Сбросить накопленные запросы после вывода.',
+        )
+
+    def handle(self, *args, **options):
+        cache = slow_queries.shared_cache()
+        rows = slow_queries.top(cache, options['top'])
+        if options['json']:
+            self.stdout.write(json.dumps(
+                [
+                    {
+                        **row,
+                        'views': row['views'].most_common(),
+                        'origins': row['origins'].most_common(),
+                    }
+                    for row in rows
+                ],
+                ensure_ascii=False,
+                indent=2,
+            ))
+        else:
+            for row in rows:
+                self.write_row(row)
+        if options['reset']:
+            slow_queries.reset(cache)
+
+    def write_row(self, row):
+        self.stdout.write(
+            f'{row["fingerprint"]}  {row["count"]} раз, '
+            f'всего {row["total"] * 1000:.1f} мс, '
+            f'среднее {row["total"] / row["count"] * 1000:.1f} мс, '
+            f'максимум {row["max"] * 1000:.1f} мс'
+        )
+        self.stdout.write(f'  {row["sql"]}')
+        for view, count in row['views'].most_common(3):
+            self.stdout.write(f'  представление {view}: {count}')
+        for place, count in row['origins'].most_common(3):
+            self.stdout.write(f'  место {place}: {count}')
@@ -0,0 +1,68 @@
+import json
+import logging
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from .timing import RequestTiming, current, header, instrument_templates
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """Время запроса в заголовке Server-Timing и в журнале.
+
+    Должен стоять первым в MIDDLEWARE, чтобы total включал всю
+    обработку. Заголовок отдается при SERVER_TIMING_HEADER или
+    сотрудникам. Запросы дольше SERVER_TIMING_SLOW пишутся
+    в журнал с уровнем WARNING, остальные - с INFO, который
+    по умолчанию отключен в LOGGING.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        timing = RequestTiming(request)
+        token = current.set(timing)
+        started = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timing.execute),
+                    )
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        total = perf_counter() - started
+        timing.add('total', total)
+        metrics = timing.metrics()
+        if settings.SERVER_TIMING_HEADER or getattr(
+            getattr(request, 'user', None), 'is_staff', False,
+        ):
+            response['Server-Timing'] = header(metrics)
+        level = (
+            logging.WARNING
+            if total >= settings.SERVER_TIMING_SLOW else logging.INFO
+        )
+        if not logger.isEnabledFor(level):
+            return response
+        logger.log(
+            level,
+            json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'view': getattr(request.resolver_match, 'view_name', None),
+                'status': response.status_code,
+                'timing': {
+                    name: {'ms': round(duration, 1), 'count': count}
+                    for name, duration, count in metrics
+                },
+            }, ensure_ascii=False),
+        )
+
+        return response
@@ -0,0 +1,24 @@
+from django.db import models
+
+
+class StoredFile(models.Model):
+    name = models.CharField(
+        'Имя файла',
+        max_length=255,
+        unique=True,
+    )
+    references = models.PositiveIntegerField(
+        'Число ссылок',
+        default=0,
+    )
+    created = models.DateTimeField(
+        'Дата сохранения',
+        auto_now_add=True,
+    )
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return self.name
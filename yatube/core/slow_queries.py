@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from time import perf_counter, time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.base import Node
+
+from . import timing
+from .snapshots import ProcessSnapshots
+
+logger = logging.getLogger(__name__)
+
+BUCKET = 60 * 60
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACES = re.compile(r'\s+')
+SKIPPED_FILES = (__file__, timing.__file__)
+
+
+def shared_cache():
+    """Общий кэш под локальным уровнем TieredCache."""
+    default = caches['default']
+
+    return getattr(default, 'shared', default)
+
+
+def normalize(sql):
+    """SQL без значений: литералы и списки параметров заменены."""
+    sql = STRINGS.sub('?', sql.replace('%s', '?'))
+    sql = LISTS.sub('(...)', NUMBERS.sub('?', sql))
+
+    return SPACES.sub(' ', sql).strip()
+
+
+def fingerprint(value):
+    return hashlib.md5(value.encode()).hexdigest()[:12]
+
+
+def origin(frame):
+    """Шаблон со строкой и ближайшая строка кода проекта."""
+    template = code = None
+    root = settings.BASE_DIR + os.sep
+    while frame is not None and not (template and code):
+        filename = frame.f_code.co_filename
+        node = frame.f_locals.get('self')
+        if (
+            template is None
+            and frame.f_code.co_name == 'render_annotated'
+            and isinstance(node, Node)
+            and getattr(node, 'token', None) is not None
+        ):
+            name = node.origin.template_name or node.origin.name
+            template = f'{name}:{node.token.lineno}'
+        elif (
+            code is None
+            and filename.startswith(root)
+            and 'site-packages' not in filename
+            and filename not in SKIPPED_FILES
+        ):
+            code = (
+                f'{os.path.relpath(filename, root)}:{frame.f_lineno}'
+                f' in {frame.f_code.co_name}'
+            )
+        frame = frame.f_back
+
+    return template, code
+
+
+class SlowQueryLog(ProcessSnapshots):
+    """Медленные запросы процесса по отпечаткам SQL за каждый час.
+
+    Отчет собирает снимки за последние SLOW_QUERY_WINDOW секунд.
+    """
+
+    def __init__(self):
+        super().__init__('slow_queries')
+
+    @property
+    def timeout(self):
+        return settings.SLOW_QUERY_WINDOW
+
+    def clear(self):
+        self.buckets = {}
+
+    def snapshot(self):
+        oldest = (time() - settings.SLOW_QUERY_WINDOW) // BUCKET
+        for bucket in [key for key in self.buckets if key < oldest]:
+            del self.buckets[bucket]
+
+        return {
+            bucket: {
+                key: {
+                    **entry,
+                    'views': dict(entry['views']),
+                    'origins': dict(entry['origins']),
+                }
+                for key, entry in entries.items()
+            }
+            for bucket, entries in self.buckets.items()
+        }
+
+    def record(self, sql, params, duration, view, template, code):
+        self.check_fork()
+        normalized = normalize(sql)
+        key = fingerprint(normalized)
+        with self.lock:
+            bucket = self.buckets.setdefault(int(time() // BUCKET), {})
+            entry = bucket.get(key)
+            if entry is None:
+                entry = bucket[key] = {
+                    'sql': normalized,
+                    'count': 0,
+                    'total': 0,
+                    'max': 0,
+                    'views': Counter(),
+                    'origins': Counter(),
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['views'][view] += 1
+            entry['origins'][' / '.join(filter(None, (template, code)))] += 1
+        if not logger.isEnabledFor(logging.WARNING):
+            return
+        logger.warning(json.dumps({
+            'fingerprint': key,
+            'params': fingerprint(repr(params)),
+            'ms': round(duration * 1000, 1),
+            'view': view,
+            'template': template,
+            'code': code,
+            'sql': normalized,
+        }, ensure_ascii=False))
+
+
+slow_queries = SlowQueryLog()
+
+
+def log_slow_query(execute, sql, params, many, context):
+    """Обертка запросов к базе, запоминающая медленные."""
+    started = perf_counter()
+    result = execute(sql, params, many, context)
+    duration = perf_counter() - started
+    if duration >= settings.SLOW_QUERY_THRESHOLD:
+        match = getattr(
+            getattr(timing.current.get(), 'request', None),
+            'resolver_match',
+            None,
+        )
+        slow_queries.record(
+            sql,
+            params,
+            duration,
+            getattr(match, 'view_name', None),
+            *origin(sys._getframe(1)),
+        )
+
+    return result
+
+
+def flush(sender, **kwargs):
+    """Снимок медленных запросов после ответа, не чаще FLUSH_INTERVAL."""
+    try:
+        slow_queries.maybe_flush(shared_cache())
+    except Exception:
+        logger.exception('Не удалось записать снимок медленных запросов')
+
+
+def install(sender, connection, **kwargs):
+    """Подключение log_slow_query к новому соединению с базой."""
+    if log_slow_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_query)
+
+
+def top(cache, limit):
+    """Самые затратные по суммарному времени запросы за окно."""
+    oldest = (time() - settings.SLOW_QUERY_WINDOW) // BUCKET
+    merged = {}
+    for snapshot in slow_queries.collect(cache):
+        for bucket, entries in snapshot.items():
+            if bucket < oldest:
+                continue
+            for key, entry in entries.items():
+                row = merged.setdefault(key, {
+                    'fingerprint': key,
+                    'sql': entry['sql'],
+                    'count': 0,
+                    'total': 0,
+                    'max': 0,
+                    'views': Counter(),
+                    'origins': Counter(),
+                })
+                row['count'] += entry['count']
+                row['total'] += entry['total']
+                row['max'] = max(row['max'], entry['max'])
+                row['views'].update(entry['views'])
+                row['origins'].update(entry['origins'])
+
+    return sorted(
+        merged.values(), key=lambda row: row['total'], reverse=True,
+    )[:limit]
+
+
+def reset(cache):
+    """Сброс отчета о медленных запросах во всех процессах."""
+    slow_queries.reset_all(cache)
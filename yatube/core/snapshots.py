@@ -0,0 +1,103 @@
+import os
+import threading
+from time import monotonic, time
+
+FLUSH_INTERVAL = 10
+
+
+def claim_slot(cache, counter, slot):
+    """Номер процесса для снимков в общем кэше.
+
+    Номер занимается заново, если счетчик пропал при очистке кэша.
+    """
+    slots = cache.get(counter)
+    if slot is None or slots is None or slots < slot:
+        cache.add(counter, 0, None)
+        slot = cache.incr(counter)
+
+    return slot
+
+
+def read_slots(cache, counter, prefix):
+    """Снимки всех процессов."""
+    slots = cache.get(counter, 0)
+
+    return list(cache.get_many(
+        [f'{prefix}{slot}' for slot in range(1, slots + 1)]
+    ).values())
+
+
+def delete_slots(cache, counter, prefix):
+    slots = cache.get(counter, 0)
+    cache.delete_many([f'{prefix}{slot}' for slot in range(1, slots + 1)])
+
+
+class ProcessSnapshots:
+    """Данные процесса, раз в FLUSH_INTERVAL секунд копируемые в общий кэш.
+
+    Каждый процесс пишет снимок под своим номером, поэтому процессы
+    не затирают данные друг друга. Потоки процесса пишут снимок
+    по очереди, чтобы номер занимался один раз. Наследники создают
+    пустые данные в clear() и копируют их в snapshot(), оба метода
+    вызываются под self.lock.
+    """
+
+    timeout = None
+
+    def __init__(self, name):
+        self.slots_key = f'{name}:slots'
+        self.slot_prefix = f'{name}:slot:'
+        self.reset_key = f'{name}:reset'
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.reset()
+
+    def clear(self):
+        raise NotImplementedError
+
+    def snapshot(self):
+        raise NotImplementedError
+
+    def reset(self):
+        with self.lock:
+            self.pid = os.getpid()
+            self.slot = None
+            self.flushed = monotonic()
+            self.started = time()
+            self.clear()
+
+    def check_fork(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def maybe_flush(self, cache):
+        if monotonic() - self.flushed >= FLUSH_INTERVAL:
+            self.flush(cache)
+
+    def flush(self, cache):
+        """Снимок в общий кэш, данные сбрасываются после reset_all."""
+        self.check_fork()
+        with self.flush_lock:
+            self.flushed = monotonic()
+            reset = cache.get(self.reset_key, 0)
+            with self.lock:
+                if reset > self.started:
+                    self.clear()
+                    self.started = time()
+                snapshot = self.snapshot()
+            self.slot = claim_slot(cache, self.slots_key, self.slot)
+            cache.set(f'{self.slot_prefix}{self.slot}', snapshot, self.timeout)
+
+    def collect(self, cache):
+        """Снимки всех процессов, включая свежий снимок текущего."""
+        self.flush(cache)
+
+        return read_slots(cache, self.slots_key, self.slot_prefix)
+
+    def reset_all(self, cache):
+        """Сброс снимков, процессы обнулят данные при следующей записи."""
+        delete_slots(cache, self.slots_key, self.slot_prefix)
+        cache.set(self.reset_key, time(), None)
+        with self.lock:
+            self.clear()
+            self.started = time()
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import tempfile
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .models import StoredFile
+
+UPLOAD_PREFIX = '.upload-'
+
+logger = logging.getLogger(__name__)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по хэшу содержимого.
+
+    Одинаковые загрузки сохраняются на диск один раз, число ссылок
+    на каждый файл хранится в StoredFile. Сохранение само берет ссылку
+    до проверки, есть ли файл на диске.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def hashed_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+
+        return '/'.join(
+            part for part in (
+                directory, digest[:2], digest[2:4], digest + extension,
+            ) if part
+        )
+
+    def _save(self, name, content):
+        os.makedirs(self.location, exist_ok=True)
+        digest = hashlib.sha256()
+        temporary = tempfile.NamedTemporaryFile(
+            dir=self.location, prefix=UPLOAD_PREFIX, delete=False,
+        )
+        try:
+            with temporary:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary.write(chunk)
+            name = self.hashed_name(name, digest.hexdigest())
+            acquire(name)
+            if not self.exists(name):
+                path = self.path(name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.chmod(temporary.name, self.file_permissions_mode or 0o644)
+                os.replace(temporary.name, path)
+        finally:
+            if os.path.exists(temporary.name):
+                os.remove(temporary.name)
+
+        return name
+
+
+def acquire(name):
+    """Новая ссылка на сохраненный файл.
+
+    Если запись удаляется вместе с файлом в этот момент, она
+    создается заново.
+    """
+    if not name:
+        return
+    while True:
+        stored, created = StoredFile.objects.get_or_create(
+            name=name,
+            defaults={'references': 1},
+        )
+        if created or StoredFile.objects.filter(pk=stored.pk).update(
+            references=F('references') + 1,
+        ):
+            return
+
+
+def release(name, storage):
+    """Снятие ссылки, файл без ссылок удаляется вместе с миниатюрами."""
+    if not name:
+        return
+    StoredFile.objects.filter(name=name, references__gt=0).update(
+        references=F('references') - 1,
+    )
+
+    def delete_unreferenced():
+        # Удаление записи с проверкой числа ссылок держит блокировку
+        # до удаления файла, и acquire в _save дождется его конца.
+        with transaction.atomic():
+            deleted, _ = StoredFile.objects.filter(
+                name=name, references=0,
+            ).delete()
+            if not deleted:
+                return
+            try:
+                default.kvstore.delete(ImageFile(name, storage))
+                storage.delete(name)
+            except (OSError, SuspiciousFileOperation):
+                logger.exception('Не удалось удалить файл %s', name)
+
+    transaction.on_commit(delete_unreferenced)
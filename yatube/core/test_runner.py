@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def test_caches(caches, directory):
+    """CACHES с файлами кэшей из TEST или во временном каталоге."""
+    result = {}
+    for alias, params in caches.items():
+        params = dict(params)
+        if 'TEST' in params:
+            params['LOCATION'] = params['TEST'].get('LOCATION') or (
+                os.path.join(directory, f'{alias}.sqlite3')
+            )
+        result[alias] = params
+
+    return result
+
+
+@contextmanager
+def isolated_caches():
+    """Отдельные файлы кэшей на время тестов.
+
+    Иначе тесты и post_migrate тестовой базы читали бы и очищали
+    кэш работающего сервера. Используется и TestRunner, и conftest
+    для py.test.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-cache-')
+    try:
+        with override_settings(
+            CACHES=test_caches(settings.CACHES, directory),
+        ):
+            yield
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """Запуск тестов с отдельными файлами кэшей."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_settings = ExitStack()
+        self.cache_settings.enter_context(isolated_caches())
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.close()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,206 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from multiprocessing import Pool
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core import cache_stats
+from core.cache import SQLiteCache, TieredCache
+from posts.models import Post, User
+
+
+def increment(location):
+    cache = SQLiteCache(location, {})
+    for _ in range(50):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.location = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(
+            self.location, {'OPTIONS': {'MAX_ENTRIES': 3}},
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_values_and_expiry(self):
+        """Значения любых типов читаются до истечения срока."""
+        self.cache.set_many({'list': [1, 'два'], 'int': 7, 'flag': True})
+        self.assertEqual(
+            self.cache.get_many(['list', 'int', 'flag', 'missing']),
+            {'list': [1, 'два'], 'int': 7, 'flag': True},
+        )
+        self.assertFalse(self.cache.add('int', 8))
+        self.cache.set('int', 8, 0)
+        self.assertIsNone(self.cache.get('int'))
+        self.assertTrue(self.cache.add('int', 9))
+        self.assertEqual(self.cache.incr('int', 2), 11)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_least_recently_read_is_evicted(self):
+        """При переполнении вытесняется давно не читавшаяся запись."""
+        for number, key in enumerate(('a', 'b', 'c')):
+            with mock.patch('core.cache.time', return_value=number * 10):
+                self.cache.set(key, number, None)
+        with mock.patch('core.cache.time', return_value=40):
+            self.cache.get('a')
+        with mock.patch('core.cache.time', return_value=50):
+            self.cache.set('d', 3, None)
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c', 'd']),
+            {'a': 0, 'c': 2, 'd': 3},
+        )
+
+    def test_entries_are_counted_every_cull_every_writes(self):
+        """Число записей проверяется раз в CULL_EVERY записей."""
+        cache = SQLiteCache(self.location, {'OPTIONS': {
+            'MAX_ENTRIES': 3, 'CULL_EVERY': 4, 'CULL_FREQUENCY': 2,
+        }})
+        for number in range(3):
+            cache.set(f'key{number}', number, None)
+        cache.set('extra', 3, None)
+        self.assertEqual(len(cache.get_many(
+            ['key0', 'key1', 'key2', 'extra']
+        )), 2)
+        cache.set('more', 4, None)
+        self.assertEqual(len(cache.get_many(
+            ['key0', 'key1', 'key2', 'extra', 'more']
+        )), 3)
+
+    def test_processes_share_values(self):
+        """Процессы видят общие значения и атомарно их увеличивают."""
+        self.cache.set('counter', 0)
+        with Pool(4) as pool:
+            pool.map(increment, [self.location] * 4)
+        self.assertEqual(self.cache.get('counter'), 200)
+
+
+@override_settings(CACHES={
+    **settings.CACHES,
+    'tiered-shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-shared',
+    },
+})
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        self.cache = TieredCache('tiered-shared', {'OPTIONS': {
+            'LOCAL_TIMEOUT': 5,
+            'LOCAL_MAX_ENTRIES': 2,
+        }})
+        self.cache.clear()
+        self.shared = self.cache.shared
+
+    def test_local_values_expire(self):
+        """Прочитанное значение живет в процессе LOCAL_TIMEOUT секунд."""
+        self.cache.set('card', 'старая')
+        self.shared.set('card', 'новая')
+        self.assertEqual(self.cache.get('card'), 'старая')
+        with mock.patch('core.cache.time', return_value=time.time() + 6):
+            self.assertEqual(self.cache.get('card'), 'новая')
+
+    def test_versions_are_always_shared(self):
+        """Версии читаются из общего кэша, минуя локальный уровень."""
+        self.cache.set('version:index', 1)
+        self.assertEqual(self.cache.get('version:index'), 1)
+        self.shared.incr('version:index')
+        self.assertEqual(self.cache.get_many(['version:index']), {
+            'version:index': 2,
+        })
+
+    def test_local_tier_is_bounded(self):
+        """Локальный уровень вытесняет давно не читавшиеся значения."""
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.shared.set_many({'a': 10, 'b': 20, 'c': 30})
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 20, 'c': 3},
+        )
+
+
+class CacheStatsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_user(username='admin', is_staff=True)
+        Post.objects.create(author=cls.admin, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        cache_stats.reset(cache.shared)
+
+    def test_key_families(self):
+        """Ключи группируются по префиксу без id и хешей."""
+        for key, name in (
+            ('version:post:12', 'version:post'),
+            ('feed_page:group:5:abc1', 'feed_page:group'),
+            ('post_card:3:1700000000.0:1:0', 'post_card'),
+            ('template.cache.index_page.d41d8cd9', 'fragment:index_page'),
+            ('sorl-thumbnail||image||5f3e', 'sorl-thumbnail:image'),
+        ):
+            with self.subTest(key=key):
+                self.assertEqual(cache_stats.family(key), name)
+
+    def test_feed_reads_are_counted(self):
+        """Промахи и попадания фрагмента ленты попадают в статистику."""
+        cache.get('template.cache.index_page.1')
+        cache.set('template.cache.index_page.1', 'фрагмент')
+        cache.get('template.cache.index_page.1')
+        cache.shared.get('template.cache.index_page.1')
+        rows = {
+            row['family']: row
+            for row in cache_stats.report(cache_stats.collect(cache.shared))
+        }
+        row = rows['fragment:index_page']
+        self.assertEqual(row['misses'], 1)
+        self.assertEqual(row['local_hits'], 1)
+        self.assertEqual(row['sets'], 1)
+        self.assertEqual(row['hit_ratio'], 0.5)
+        self.assertGreater(row['bytes_written'], 0)
+        self.assertGreater(row['bytes_read'], 0)
+        self.assertEqual(sum(row['latency']), 2)
+
+    def test_concurrent_flushes_claim_one_slot(self):
+        """Потоки процесса пишут снимок под одним номером."""
+        cache_stats.stats.reset()
+        cache.get('feed:1')
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(
+                lambda _: cache_stats.stats.flush(cache.shared), range(8),
+            ))
+        self.assertEqual(cache.shared.get(cache_stats.stats.slots_key), 1)
+        self.assertEqual(
+            cache_stats.collect(cache.shared)['feed']['misses'], 1,
+        )
+
+    def test_stats_view_and_command(self):
+        """Статистику видят только администраторы и команда."""
+        self.client.get(reverse('posts:index'))
+        url = reverse('cache_stats')
+        self.assertRedirects(
+            self.client.get(url), f'/admin/login/?next={url}',
+        )
+        admin = Client()
+        admin.force_login(self.admin)
+        self.assertContains(admin.get(url), 'fragment:index_page')
+        out = StringIO()
+        call_command('cache_stats', '--json', stdout=out)
+        self.assertIn('"fragment:index_page"', out.getvalue())
+        call_command('cache_stats', '--reset', stdout=StringIO())
+        self.assertNotIn(
+            'fragment:index_page', cache_stats.collect(cache.shared),
+        )
@@ -0,0 +1,152 @@
+import json
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import slow_queries
+from posts.models import Follow, Post, User
+
+
+class ServerTimingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+
+    def metrics(self, response):
+        return {
+            part.split(';')[0]: part
+            for part in response['Server-Timing'].split(', ')
+        }
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_for_staff_only(self):
+        """Заголовок видят только сотрудники."""
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        metrics = self.metrics(self.staff_client.get(url))
+        for name in (
+            'total', 'db', 'cache', 'tpl-posts-post_detail',
+            'tpl-includes-header',
+        ):
+            self.assertIn(name, metrics)
+        self.assertNotIn('Server-Timing', self.client.get(url))
+
+    def test_included_templates_and_queries(self):
+        """Время разбито по подключаемым шаблонам, запросы посчитаны."""
+        for number in range(3):
+            Post.objects.create(author=self.user, text=f'Пост {number}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.staff_client.get(reverse('posts:follow_index'))
+        metrics = self.metrics(response)
+        self.assertIn(f'x{len(queries)}"', metrics['db'])
+        self.assertIn('tpl-posts-includes-paginator', metrics)
+        response = self.staff_client.get(reverse('posts:index'))
+        self.assertIn('x4"', self.metrics(response)[
+            'tpl-posts-includes-post_card'
+        ])
+
+    def test_slow_requests_are_logged(self):
+        """Медленный запрос пишется в журнал как предупреждение."""
+        with override_settings(SERVER_TIMING_SLOW=0):
+            with self.assertLogs('core.middleware', 'WARNING') as logs:
+                self.client.get(reverse('posts:index'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'posts:index')
+        self.assertEqual(record['status'], 200)
+        self.assertIn('total', record['timing'])
+
+    def test_fast_requests_are_not_serialized(self):
+        """Быстрый запрос не сериализуется при уровне WARNING."""
+        with mock.patch('core.middleware.json.dumps') as dumps:
+            self.client.get(reverse('posts:index'))
+        dumps.assert_not_called()
+
+
+class SlowQueryLogTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='user')
+        cls.author = User.objects.create_user(username='author')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        slow_queries.reset(slow_queries.shared_cache())
+        self.client.force_login(self.user)
+
+    def test_normalize(self):
+        """Значения в SQL заменяются, списки параметров сворачиваются."""
+        self.assertEqual(
+            slow_queries.normalize(
+                "SELECT * FROM t WHERE a = 'x''y' AND b IN (%s, %s,%s)\n"
+                'LIMIT 20 OFFSET 40'
+            ),
+            'SELECT * FROM t WHERE a = ? AND b IN (...) LIMIT ? OFFSET ?',
+        )
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_queries_are_attributed(self):
+        """Запросы запоминаются с представлением и местом вызова."""
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('posts:follow_index'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(
+            set(record),
+            {'fingerprint', 'params', 'ms', 'view', 'template', 'code',
+             'sql'},
+        )
+        rows = slow_queries.top(slow_queries.shared_cache(), 100)
+        views = {view for row in rows for view in row['views']}
+        self.assertIn('posts:follow_index', views)
+        origins = [origin for row in rows for origin in row['origins']]
+        self.assertIn('posts/timeline.py:', ' '.join(origins))
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            Template(
+                '{% for user in users %}\n{{ user }}{% endfor %}'
+            ).render(Context({'users': User.objects.all()}))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['template'], '<unknown source>:1')
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_failed_queries_are_not_recorded(self):
+        """Запрос, завершившийся ошибкой, не попадает в отчет."""
+        execute = mock.Mock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            slow_queries.log_slow_query(execute, 'SELECT 1', (), False, {})
+        self.assertEqual(slow_queries.slow_queries.buckets, {})
+
+    def test_flush_errors_are_logged(self):
+        """Ошибка записи снимка после ответа пишется в журнал."""
+        with mock.patch.object(
+            slow_queries.slow_queries, 'flushed', 0,
+        ), mock.patch.object(
+            slow_queries.slow_queries, 'flush', side_effect=OSError,
+        ), self.assertLogs('core.slow_queries', 'ERROR'):
+            response = self.client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_command_prints_top(self):
+        """Команда выводит отчет и сбрасывает его."""
+        with self.assertLogs('core.slow_queries', 'WARNING'):
+            Post.objects.filter(text='Пост').count()
+        out = StringIO()
+        call_command('slow_queries', '--top', '1', '--reset', stdout=out)
+        self.assertIn('SELECT COUNT(*)', out.getvalue())
+        self.assertEqual(slow_queries.top(slow_queries.shared_cache(), 5), [])
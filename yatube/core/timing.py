@@ -0,0 +1,123 @@
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from django.template.base import Template
+
+current = ContextVar('request_timing', default=None)
+TOKEN = re.compile(r'[^0-9A-Za-z_-]+')
+
+
+class RequestTiming:
+    """Время запроса по частям: база, кэш, шаблоны.
+
+    Для шаблонов считается собственное время без вложенных include,
+    поэтому их сумма равна времени рендера страницы. Обращения к базе
+    и кэшу из шаблонов входят и во время шаблона.
+    """
+
+    def __init__(self, request=None):
+        self.request = request
+        self.durations = Counter()
+        self.counts = Counter()
+        self.stack = []
+
+    def add(self, name, seconds):
+        self.durations[name] += seconds
+        self.counts[name] += 1
+
+    def execute(self, execute, sql, params, many, context):
+        """Обертка запросов к базе для connection.execute_wrapper."""
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', perf_counter() - started)
+
+    @contextmanager
+    def template(self, name):
+        started = perf_counter()
+        self.stack.append(0)
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - started
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            self.add(f'tpl:{name}', elapsed - nested)
+
+    def metrics(self):
+        """Имя, время в миллисекундах и число вызовов, медленные сначала."""
+        return [
+            (name, self.durations[name] * 1000, self.counts[name])
+            for name in sorted(
+                self.durations, key=self.durations.get, reverse=True,
+            )
+        ]
+
+
+def timed(name):
+    """Время вызовов функции в текущем запросе под именем name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timing = current.get()
+            if timing is None:
+                return func(*args, **kwargs)
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timing.add(name, perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_templates():
+    """Замер рендера каждого шаблона, в том числе подключаемых.
+
+    Оборачивается текущий Template._render, поэтому замена
+    на время тестов сохраняется.
+    """
+    render = Template._render
+    if getattr(render, 'timed', False):
+        return
+
+    @wraps(render)
+    def timed_render(self, context):
+        timing = current.get()
+        if timing is None:
+            return render(self, context)
+        name = self.origin.template_name or self.name or 'string'
+        with timing.template(name):
+            return render(self, context)
+
+    timed_render.timed = True
+    Template._render = timed_render
+
+
+def token(name):
+    """Имя метрики Server-Timing из допустимых символов."""
+    if name.startswith('tpl:'):
+        name = os.path.splitext(name)[0]
+
+    return TOKEN.sub('-', name).strip('-')
+
+
+def header(metrics):
+    """Значение заголовка Server-Timing."""
+    parts = []
+    for name, duration, count in metrics:
+        description = name.replace('"', '')
+        parts.append(
+            f'{token(name)};dur={duration:.1f};desc="{description} x{count}"'
+        )
+
+    return ', '.join(parts)
@@ -1,4 +1,31 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+from . import cache_stats
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{32,64}\.\w+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
 
 
 def page_not_found(request, exception):
@@ -11,3 +38,137 @@ def csrf_failure(request, reason=''):
 
 def internal_server_error(request, reason=''):
     return render(request, 'core/500.html')
+
+
+@never_cache
+@staff_member_required
+def cache_stats_view(request):
+    """Статистика кэша по семействам ключей для администраторов."""
+    shared = getattr(cache, 'shared', cache)
+    context = {
+        'rows': cache_stats.report(cache_stats.collect(shared)),
+        'buckets': cache_stats.LATENCY_BUCKETS,
+    }
+
+    return render(request, 'core/cache_stats.html', context)
+
+
+def if_range_matches(request, etag, last_modified):
+    """Совпадение If-Range с ETag или датой изменения файла."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def byte_range(request, etag, last_modified, size):
+    """Запрошенный диапазон байт, None для всего файла."""
+    header = request.META.get('HTTP_RANGE', '')
+    match = RANGE.match(header.replace(' ', ''))
+    if not match or not if_range_matches(request, etag, last_modified):
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        raise ValueError(header)
+
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    """Отдача медиафайлов с Range, условными запросами и sendfile.
+
+    Если задан MEDIA_SENDFILE_HEADER, файл отдает фронтенд-сервер,
+    иначе WSGI-сервер через wsgi.file_wrapper. Скрытые файлы
+    и каталоги, например недописанные загрузки и карантин, не отдаются.
+    """
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        file_stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404
+    etag = f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(file_stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (
+            f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+            if HASHED_NAME.search(path)
+            else f'public, max-age={settings.MEDIA_MAX_AGE}'
+        ),
+    }
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(file_stat.st_mtime),
+    )
+    if response is None:
+        response = media_response(request, full_path, path, file_stat, etag)
+    for header, value in headers.items():
+        response.setdefault(header, value)
+
+    return response
+
+
+def media_response(request, full_path, path, file_stat, etag):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    sendfile_header = settings.MEDIA_SENDFILE_HEADER
+    if sendfile_header:
+        response = HttpResponse(content_type=content_type)
+        response[sendfile_header] = (
+            settings.MEDIA_ACCEL_PREFIX + quote(path)
+            if sendfile_header == 'X-Accel-Redirect'
+            else full_path
+        )
+        return response
+    size = file_stat.st_size
+    try:
+        requested = byte_range(
+            request, etag, int(file_stat.st_mtime), size,
+        )
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if requested is None or requested == (0, size - 1):
+        response = FileResponse(
+            open(full_path, 'rb'), content_type=content_type,
+        )
+    else:
+        start, end = requested
+        response = StreamingHttpResponse(
+            read_range(full_path, start, end - start + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if encoding:
+        response['Content-Encoding'] = encoding
+
+    return response
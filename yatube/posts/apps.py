@@ -5,3 +5,6 @@ class PostsConfig(AppConfig):
     """Конфигурция приложения posts"""
 
     name = 'posts'
+
+    def ready(self):
+        from . import signals  # noqa: F401
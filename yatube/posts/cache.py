@@ -0,0 +1,223 @@
+import hashlib
+import math
+import random
+from functools import wraps
+from time import sleep, time
+
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
+
+from .constants import (
+    FEED_CACHE_TIMEOUT,
+    REBUILD_LOCK_TIMEOUT,
+    REBUILD_POLL_INTERVAL,
+    STALE_TIMEOUT,
+    XFETCH_BETA,
+)
+
+
+def _initial_version():
+    """Начальная версия, не совпадающая с вытесненными из кэша."""
+    return int(time() * 1000)
+
+
+def get_version(name):
+    """Текущая версия набора данных в кэше."""
+    return get_versions([name])[name]
+
+
+def get_versions(names):
+    """Версии нескольких наборов данных за одно обращение к кэшу."""
+    keys = {f'version:{name}': name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, _initial_version(), None)
+        versions[key] = cache.get(key, _initial_version())
+
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_version(*names):
+    """Инвалидация всех ключей, построенных на версиях names."""
+    for name in names:
+        key = f'version:{name}'
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), None)
+
+
+def refresh(key, compute, timeout, stale_key=None):
+    """Пересчет значения с запоминанием времени расчета и истечения."""
+    started = time()
+    value = compute()
+    finished = time()
+    entry = (value, finished - started, finished + timeout)
+    entries = {key: entry}
+    if stale_key:
+        entries[stale_key] = entry
+    cache.set_many(entries, timeout + STALE_TIMEOUT)
+
+    return value
+
+
+def cached(key, compute, timeout, stale_key=None, beta=XFETCH_BETA):
+    """Значение из кэша без лавины одновременных пересчетов.
+
+    Ключ пересчитывается заранее с вероятностью, растущей к истечению
+    (XFetch), и только одним процессом под блокировкой. Остальные
+    в это время получают устаревшее значение: запись хранится дольше
+    timeout на STALE_TIMEOUT, а stale_key переживает смену версий
+    в key. Если отдать нечего, ждут завершения пересчета.
+
+    Возвращает пару (значение, устарело). Устаревшим считается только
+    значение из stale_key: оно построено для прежних версий данных.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expiry = entry
+        if time() - delta * beta * math.log(1 - random.random()) < expiry:
+            return value, False
+    lock = f'lock:{key}'
+    if cache.add(lock, 1, REBUILD_LOCK_TIMEOUT):
+        try:
+            return refresh(key, compute, timeout, stale_key), False
+        finally:
+            cache.delete(lock)
+    if entry is not None:
+        return entry[0], False
+    if stale_key:
+        entry = cache.get(stale_key)
+        if entry is not None:
+            return entry[0], True
+    deadline = time() + REBUILD_LOCK_TIMEOUT
+    while time() < deadline:
+        sleep(REBUILD_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0], False
+
+    return refresh(key, compute, timeout, stale_key), False
+
+
+def mark_stale(request):
+    """Ответ собран из значений прежних версий и не должен кэшироваться."""
+    if request is not None:
+        request.page_cache_stale = True
+
+
+def post_feeds(author_id, group_id):
+    """Ленты, в которые попадает пост."""
+    feeds = ['index', f'profile:{author_id}']
+    if group_id:
+        feeds.append(f'group:{group_id}')
+
+    return feeds
+
+
+def feed_cache(request, *feeds):
+    """Ключи и время жизни фрагмента страницы ленты.
+
+    feed_stale_key не зависит от версий и указывает на последний
+    построенный вариант той же страницы.
+    """
+    versions = get_versions(feeds + ('cards',))
+    feed_key = ':'.join(
+        f'{name}.{version}' for name, version in sorted(versions.items())
+    )
+    page = f'{request.user.is_authenticated}|{request.GET.urlencode()}'
+
+    return {
+        'feed_key': f'{feed_key}|{page}',
+        'feed_stale_key': f'{":".join(feeds)}|{page}',
+        'feed_timeout': FEED_CACHE_TIMEOUT,
+    }
+
+
+def page_etag(request, versions):
+    """Валидатор страницы по версиям данных, пользователю и параметрам.
+
+    Для вошедших пользователей в него входят подписки и CSRF-cookie,
+    от которых зависят фрагменты страницы и формы на ней.
+    """
+    parts = [
+        f'{name}.{version}' for name, version in sorted(versions.items())
+    ]
+    if request.user.is_authenticated:
+        parts += [
+            str(request.user.pk),
+            str(get_version(f'follow:{request.user.pk}')),
+            request.META.get('CSRF_COOKIE', ''),
+        ]
+    parts.append(request.GET.urlencode())
+
+    return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def tagged_page(tags_func):
+    """Условный GET и кэш страниц для гостей по версиям тегов.
+
+    tags_func возвращает имена версий, от которых зависит страница,
+    или None, если объекта нет. Версии сохраняются в запросе для
+    AnonymousPageCacheMiddleware. Ответ с устаревшими фрагментами
+    уходит без ETag и с no-cache.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            tags = tags_func(request, *args, **kwargs)
+            if tags is None:
+                return view(request, *args, **kwargs)
+            versions = get_versions(tuple(tags) + ('cards',))
+            request.page_cache_versions = versions
+            response = etag(
+                lambda request, *args, **kwargs: page_etag(request, versions)
+            )(view)(request, *args, **kwargs)
+            if getattr(request, 'page_cache_stale', False):
+                # Валидатор построен по новым версиям и не подходит
+                # для содержимого из прежних.
+                del response['ETag']
+                patch_cache_control(response, no_cache=True)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def card_key(post, group=None):
+    """Ключ карточки поста, меняется при каждом изменении поста."""
+    group_link = bool(post.group_id) and (
+        group is None or group.pk != post.group_id
+    )
+
+    return (
+        f'post_card:{post.pk}:{post.updated.timestamp()}'
+        f':{post.group_id}:{group_link:d}'
+    )
+
+
+def feed_count(name, counter, timeout):
+    """Число постов в ленте без COUNT на каждый запрос."""
+    key = f'count:{name}'
+    count = cache.get(key)
+    if count is None:
+        count = counter()
+        cache.add(key, count, timeout)
+
+    return count
+
+
+def shift_count(delta, *names):
+    """Поправка сохраненного числа постов лент."""
+    for name in names:
+        try:
+            cache.incr(f'count:{name}', delta)
+        except ValueError:
+            pass
+
+
+def drop_count(*names):
+    cache.delete_many([f'count:{name}' for name in names])
@@ -2,3 +2,42 @@ LIMIT_POSTS = 15
 NUMB_OF_POSTS = 10
 NUMB_OF_POSTS_TEST = 13
 NUMB_OF_POSTS_2 = 3
+ANCHORS_CACHE_TIMEOUT = 60 * 60
+FEED_COUNT_TIMEOUT = 60 * 15
+FOLLOW_COUNT_TIMEOUT = 60
+PAGE_WINDOW = 2
+TIMELINE_LENGTH = 1000
+# Посты автора с большим числом подписчиков читаются напрямую, рассылка
+# возобновляется, когда подписчиков не больше FANOUT_RESUME_FOLLOWERS.
+FANOUT_MAX_FOLLOWERS = 1000
+FANOUT_RESUME_FOLLOWERS = 800
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+CARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Параметры запроса, от которых зависит страница; с другими она не кэшируется.
+PAGE_CACHE_PARAMS = ('page', 'after', 'before', 'q')
+STALE_TIMEOUT = 60 * 5
+REBUILD_LOCK_TIMEOUT = 10
+REBUILD_POLL_INTERVAL = 0.05
+XFETCH_BETA = 1.0
+NUMB_OF_COMMENTS = 20
+SEARCH_LIMIT = 1000
+IMAGE_WIDTHS = (320, 640, 960)
+IMAGE_FORMATS = ('WEBP', 'JPEG')
+IMAGE_SIZES = '(max-width: 960px) 100vw, 960px'
+THUMBNAIL_GEOMETRIES = tuple(
+    (
+        f'{width}x{width * 339 // 960}',
+        {'crop': 'center', 'upscale': True, 'format': image_format},
+    )
+    for image_format in IMAGE_FORMATS
+    for width in IMAGE_WIDTHS
+)
+THUMBNAIL_MAX_ATTEMPTS = 3
+PREVIEW_SIZE = (16, 16)
+PREVIEW_QUALITY = 40
+# Основной цвет ищется среди стольких цветов уменьшенной копии.
+COLOR_SAMPLE_SIZE = (64, 64)
+DOMINANT_COLORS = 8
+IMAGE_MAX_SIZE = 2048
+IMAGE_QUALITY = 85
@@ -0,0 +1,91 @@
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Comment, Follow, Post, User, UserCounter
+
+COUNTER_FIELDS = ('posts_count', 'followers_count', 'following_count')
+
+
+def shift_counter(user_id, field, delta):
+    """Атомарное изменение счетчика пользователя, не ниже нуля."""
+    updated = UserCounter.objects.filter(user_id=user_id).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+    if not updated and delta > 0:
+        reconcile_users([user_id])
+
+
+def shift_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0)
+    )
+
+
+def _grouped_counts(queryset, field, ids):
+    return dict(
+        queryset.filter(**{f'{field}__in': ids}).order_by().values(
+            field,
+        ).annotate(count=Count('pk')).values_list(field, 'count')
+    )
+
+
+def reconcile_users(user_ids):
+    """Пересчет счетчиков пользователей, возвращает число исправленных."""
+    posts = _grouped_counts(Post.objects.all(), 'author_id', user_ids)
+    followers = _grouped_counts(Follow.objects.all(), 'author_id', user_ids)
+    following = _grouped_counts(Follow.objects.all(), 'user_id', user_ids)
+    counters = {
+        counter.user_id: counter
+        for counter in UserCounter.objects.filter(user_id__in=user_ids)
+    }
+    changed = 0
+    for user_id in user_ids:
+        actual = dict(zip(COUNTER_FIELDS, (
+            posts.get(user_id, 0),
+            followers.get(user_id, 0),
+            following.get(user_id, 0),
+        )))
+        counter = counters.get(user_id)
+        if counter is None:
+            UserCounter.objects.get_or_create(user_id=user_id, defaults=actual)
+            changed += 1
+        elif any(getattr(counter, name) != value
+                 for name, value in actual.items()):
+            UserCounter.objects.filter(pk=counter.pk).update(**actual)
+            changed += 1
+
+    return changed
+
+
+def reconcile_posts(post_ids):
+    """Пересчет числа комментариев, возвращает число исправленных."""
+    comments = _grouped_counts(Comment.objects.all(), 'post_id', post_ids)
+    changed = []
+    for post in Post.objects.filter(pk__in=post_ids).only('comments_count'):
+        if post.comments_count != comments.get(post.pk, 0):
+            post.comments_count = comments.get(post.pk, 0)
+            changed.append(post)
+    Post.objects.bulk_update(changed, ['comments_count'])
+
+    return len(changed)
+
+
+def user_ids_chunks(chunk_size):
+    return _chunks(User.objects.all(), chunk_size)
+
+
+def post_ids_chunks(chunk_size):
+    return _chunks(Post.objects.all(), chunk_size)
+
+
+def _chunks(queryset, chunk_size):
+    """Первичные ключи порциями по возрастанию."""
+    last = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list(
+            'pk', flat=True,
+        )[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
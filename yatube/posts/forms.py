@@ -1,5 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 
+from .images import normalize
 from .models import Post, Comment
 
 
@@ -15,6 +18,18 @@ class PostForm(forms.ModelForm):
             'image': 'Картинка',
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if not isinstance(image, UploadedFile):
+            return image
+        try:
+            return normalize(image)
+        except (OSError, Image.DecompressionBombError):
+            raise forms.ValidationError(
+                'Не удалось обработать картинку.',
+                code='invalid_image',
+            )
+
 
 class CommentForm(forms.ModelForm):
     """Форма для создания комментария"""
@@ -0,0 +1,211 @@
+import logging
+import os
+import shutil
+from itertools import islice
+from time import monotonic, sleep, time
+
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    KVStore as CachedDbKVStore,
+)
+from sorl.thumbnail.models import KVStore
+
+from core.models import StoredFile
+from core.storage import UPLOAD_PREFIX
+from .models import Post
+from .thumbnails import load_thumbnails
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit:
+    """Не больше rate операций ввода-вывода в секунду."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = monotonic()
+
+    def __call__(self):
+        if not self.interval:
+            return
+        now = monotonic()
+        if self.next > now:
+            sleep(self.next - now)
+        self.next = max(self.next, now) + self.interval
+
+
+def walk(storage, directory, throttle):
+    """Файлы каталога хранилища в порядке файловой системы.
+
+    Каталог читается потоком scandir без сортировки, и память
+    не зависит от числа файлов в нем.
+    """
+    throttle()
+    try:
+        scan = os.scandir(storage.path(directory))
+    except FileNotFoundError:
+        return
+    with scan:
+        for entry in scan:
+            name = f'{directory}/{entry.name}'
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(storage, name, throttle)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class MediaCollector:
+    """Удаление файлов и записей kvstore, на которые не ссылаются посты.
+
+    Файлы моложе min_age пропускаются: их пост может быть еще
+    не сохранен.
+    """
+
+    def __init__(self, dry_run=False, quarantine=None, rate=0,
+                 min_age=3600, chunk_size=1000):
+        self.dry_run = dry_run
+        self.quarantine = quarantine
+        self.throttle = RateLimit(rate)
+        self.chunk_size = chunk_size
+        self.deadline = time() - min_age
+        self.storage = Post._meta.get_field('image').storage
+        self.prefix = Post._meta.get_field('image').upload_to.rstrip('/')
+        self.stats = dict.fromkeys(
+            ('images', 'thumbnails', 'kvstore', 'bytes'), 0,
+        )
+
+    def collect(self):
+        self.collect_images()
+        self.collect_kvstore()
+        self.collect_thumbnails()
+
+        return self.stats
+
+    def is_old(self, entry):
+        return entry.stat(follow_symlinks=False).st_mtime < self.deadline
+
+    def remove(self, storage, name, entry, quarantine=True):
+        self.stats['bytes'] += entry.stat(follow_symlinks=False).st_size
+        logger.info('Удаление %s', name)
+        if self.dry_run:
+            return
+        if quarantine and self.quarantine:
+            target = os.path.join(self.quarantine, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(entry.path, target)
+        else:
+            storage.delete(name)
+
+    def remove_unreferenced(self, name, entry):
+        """Удаление картинки, если у нее по-прежнему нет ссылок.
+
+        Как и в release, запись StoredFile удаляется с проверкой числа
+        ссылок до удаления файла, и acquire в _save дождется конца.
+        """
+        if self.dry_run:
+            self.remove(self.storage, name, entry)
+            return True
+        self.throttle()
+        with transaction.atomic():
+            StoredFile.objects.get_or_create(
+                name=name, defaults={'references': 0},
+            )
+            deleted, _ = StoredFile.objects.filter(
+                name=name, references=0,
+            ).delete()
+            if not deleted:
+                return False
+            self.remove(self.storage, name, entry)
+
+        return True
+
+    def collect_images(self):
+        """Картинки на диске без постов и ссылок в StoredFile."""
+        files = (
+            (name, entry)
+            for name, entry in walk(self.storage, self.prefix, self.throttle)
+            if not entry.name.startswith(UPLOAD_PREFIX)
+        )
+        for chunk in chunked(files, self.chunk_size):
+            names = [name for name, _ in chunk]
+            referenced = set(
+                Post.objects.filter(image__in=names)
+                .values_list('image', flat=True)
+            )
+            referenced.update(
+                StoredFile.objects.filter(name__in=names, references__gt=0)
+                .values_list('name', flat=True)
+            )
+            for name, entry in chunk:
+                if (
+                    name not in referenced
+                    and self.is_old(entry)
+                    and self.remove_unreferenced(name, entry)
+                ):
+                    self.stats['images'] += 1
+
+    def collect_kvstore(self):
+        """Записи kvstore и миниатюры картинок без постов."""
+        if not isinstance(default.kvstore, CachedDbKVStore):
+            logger.warning('Очистка kvstore поддерживается только для БД')
+            return
+        prefix = add_prefix('')
+        last = prefix
+        while True:
+            rows = list(
+                KVStore.objects.filter(key__startswith=prefix, key__gt=last)
+                .order_by('key')
+                .values_list('key', 'value')[:self.chunk_size]
+            )
+            if not rows:
+                return
+            last = rows[-1][0]
+            sources = {}
+            for _, value in rows:
+                image = deserialize_image_file(value)
+                if not image.name.startswith(
+                    thumbnail_settings.THUMBNAIL_PREFIX
+                ):
+                    sources[image.name] = image
+            referenced = set(
+                Post.objects.filter(image__in=sources)
+                .values_list('image', flat=True)
+            )
+            for name in sources.keys() - referenced:
+                logger.info('Удаление миниатюр %s', name)
+                self.stats['kvstore'] += 1
+                if not self.dry_run:
+                    self.throttle()
+                    default.kvstore.delete(sources[name])
+
+    def collect_thumbnails(self):
+        """Файлы миниатюр без записи в kvstore."""
+        thumbnails = walk(
+            default.storage,
+            thumbnail_settings.THUMBNAIL_PREFIX.rstrip('/'),
+            self.throttle,
+        )
+        for chunk in chunked(thumbnails, self.chunk_size):
+            chunk = dict(chunk)
+            found = load_thumbnails({
+                name: ImageFile(name, default.storage) for name in chunk
+            })
+            for name, entry in chunk.items():
+                if name not in found and self.is_old(entry):
+                    if not self.dry_run:
+                        self.throttle()
+                    self.remove(default.storage, name, entry, False)
+                    self.stats['thumbnails'] += 1
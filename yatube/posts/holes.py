@@ -0,0 +1,78 @@
+import re
+from urllib.parse import parse_qsl, urlencode
+
+from django.template.loader import render_to_string
+
+from .forms import CommentForm
+from .models import Follow
+
+HOLE = re.compile(r'<!--hole:([\w-]+)\?([^>]*?)-->')
+FILLED_HOLE = re.compile(r'(<!--hole:[\w-]+\?[^>]*?-->).*?<!--/hole-->', re.S)
+
+HOLES = {}
+
+
+def hole(name, template):
+    """Регистрация пользовательского фрагмента страницы."""
+    def decorator(func):
+        HOLES[name] = (template, func)
+        return func
+
+    return decorator
+
+
+@hole('header', 'includes/header.html')
+def header(request):
+    return {}
+
+
+@hole('switcher', 'posts/includes/switcher.html')
+def switcher(request):
+    return {}
+
+
+@hole('follow', 'posts/includes/follow_button.html')
+def follow_button(request, author):
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user,
+        author__username=author,
+    ).exists()
+
+    return {'author_username': author, 'following': following}
+
+
+@hole('post_actions', 'posts/includes/post_actions.html')
+def post_actions(request, post, author):
+    return {
+        'post_id': int(post),
+        'author_id': int(author),
+        'form': CommentForm(),
+    }
+
+
+def render_hole(request, name, params):
+    template, get_context = HOLES[name]
+
+    return render_to_string(template, get_context(request, **params), request)
+
+
+def mark_hole(name, params, html):
+    """Фрагмент в метках, по которым его вырезает кэш страниц."""
+    return f'<!--hole:{name}?{urlencode(params)}-->{html}<!--/hole-->'
+
+
+def punch_holes(content):
+    """Скелет страницы: содержимое фрагментов заменено метками."""
+    return FILLED_HOLE.sub(r'\1', content)
+
+
+def fill_holes(request, content):
+    """Заполнение меток скелета фрагментами текущего пользователя."""
+    return HOLE.sub(
+        lambda match: mark_hole(
+            match[1],
+            dict(parse_qsl(match[2])),
+            render_hole(request, match[1], dict(parse_qsl(match[2]))),
+        ),
+        content,
+    )
@@ -0,0 +1,152 @@
+import base64
+import logging
+import os
+from io import BytesIO
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+from .constants import (
+    COLOR_SAMPLE_SIZE,
+    DOMINANT_COLORS,
+    IMAGE_MAX_SIZE,
+    IMAGE_QUALITY,
+    PREVIEW_QUALITY,
+    PREVIEW_SIZE,
+)
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELDS = (
+    'image_width',
+    'image_height',
+    'image_size',
+    'image_color',
+    'image_preview',
+)
+
+
+def has_transparency(image):
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if 'A' not in image.getbands():
+        return False
+
+    return image.getchannel('A').getextrema()[0] < 255
+
+
+def normalize(upload):
+    """Загруженная картинка, уменьшенная и перекодированная без EXIF.
+
+    JPEG декодируется сразу в уменьшенном масштабе через draft(),
+    анимация сохраняется как есть.
+    """
+    upload.seek(0)
+    with Image.open(upload) as source:
+        if getattr(source, 'is_animated', False):
+            upload.seek(0)
+            return upload
+        source.draft('RGB', (IMAGE_MAX_SIZE, IMAGE_MAX_SIZE))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((IMAGE_MAX_SIZE, IMAGE_MAX_SIZE), Image.LANCZOS)
+    buffer = BytesIO()
+    if has_transparency(image):
+        image.convert('RGBA').save(buffer, 'WEBP', quality=IMAGE_QUALITY)
+        extension, content_type = '.webp', 'image/webp'
+    else:
+        image.convert('RGB').save(
+            buffer,
+            'JPEG',
+            quality=IMAGE_QUALITY,
+            optimize=True,
+            progressive=True,
+        )
+        extension, content_type = '.jpg', 'image/jpeg'
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type)
+
+
+def dominant_color(image):
+    """Самый частый цвет картинки после сведения к DOMINANT_COLORS."""
+    sample = image.copy()
+    sample.thumbnail(COLOR_SAMPLE_SIZE)
+    sample = sample.quantize(DOMINANT_COLORS)
+    _, index = max(sample.getcolors())
+
+    return tuple(sample.getpalette()[index * 3:index * 3 + 3])
+
+
+def describe(image):
+    """Размеры, цвет и превью картинки для шаблонов."""
+    image.open('rb')
+    try:
+        with Image.open(image) as source:
+            source.load()
+            width, height = source.size
+            source = source.convert('RGB')
+        preview = source.copy()
+        preview.thumbnail(PREVIEW_SIZE)
+        buffer = BytesIO()
+        preview.save(buffer, 'JPEG', quality=PREVIEW_QUALITY)
+        red, green, blue = dominant_color(source)
+        size = image.size
+    finally:
+        if image._committed:
+            image.close()
+        else:
+            image.seek(0)
+
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': size,
+        'image_color': f'#{red:02x}{green:02x}{blue:02x}',
+        'image_preview': 'data:image/jpeg;base64,' + base64.b64encode(
+            buffer.getvalue()
+        ).decode(),
+    }
+
+
+def describe_post(post):
+    """Заполнение описания картинки поста, False для битого файла."""
+    metadata = dict.fromkeys(IMAGE_FIELDS)
+    metadata.update(image_color='', image_preview='')
+    described = True
+    if post.image:
+        try:
+            metadata.update(describe(post.image))
+        except (
+            OSError,
+            ValueError,
+            Image.DecompressionBombError,
+            SuspiciousFileOperation,
+        ):
+            logger.warning('Не удалось прочитать картинку %s', post.image)
+            described = False
+    for field, value in metadata.items():
+        setattr(post, field, value)
+
+    return described
+
+
+def backfill(batch_size):
+    """Описание картинок постов, сохраненных до появления полей."""
+    described = failed = 0
+    posts = Post.objects.exclude(image='').filter(image_width__isnull=True)
+    last_pk = 0
+    while True:
+        batch = list(
+            posts.filter(pk__gt=last_pk).order_by('pk')[:batch_size]
+        )
+        if not batch:
+            return described, failed
+        for post in batch:
+            if describe_post(post):
+                described += 1
+            else:
+                failed += 1
+        Post.objects.bulk_update(batch, IMAGE_FIELDS)
+        last_pk = batch[-1].pk
@@ -0,0 +1,80 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.garbage import MediaCollector
+
+
+class Command(BaseCommand):
+    help = 'Удаляет картинки и миниатюры, на которые не ссылаются посты.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+        parser.add_argument(
+            '--quarantine',
+            help=(
+                'Каталог, куда переносятся картинки вместо удаления. '
+                'Внутри MEDIA_ROOT его имя должно начинаться с точки.'
+            ),
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='Не больше операций с диском в секунду, 0 - без ограничения.',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Файлы моложе стольких секунд не трогаются.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Число имен, читаемых из базы за один запрос.',
+        )
+
+    def check_quarantine(self, quarantine):
+        """Карантин внутри MEDIA_ROOT раздавался бы как медиафайлы."""
+        parts = os.path.relpath(
+            os.path.abspath(quarantine), settings.MEDIA_ROOT,
+        ).split(os.sep)
+        if parts[0] == os.pardir:
+            return
+        if not any(
+            part.startswith('.') and part not in (os.curdir, os.pardir)
+            for part in parts
+        ):
+            raise CommandError(
+                'Карантин внутри MEDIA_ROOT должен быть скрытым каталогом, '
+                'например .quarantine.'
+            )
+
+    def handle(self, *args, **options):
+        if options['quarantine']:
+            self.check_quarantine(options['quarantine'])
+        collector = MediaCollector(
+            dry_run=options['dry_run'],
+            quarantine=options['quarantine'],
+            rate=options['rate'],
+            min_age=options['min_age'],
+            chunk_size=options['chunk_size'],
+        )
+        try:
+            stats = collector.collect()
+        except ValueError as error:
+            raise CommandError(error)
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} картинок: {stats["images"]}, '
+            f'миниатюр: {stats["thumbnails"]}, '
+            f'записей kvstore: {stats["kvstore"]}, '
+            f'байт: {stats["bytes"]}'
+        ))
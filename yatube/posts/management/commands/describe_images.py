@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import backfill
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет размеры, цвет и превью картинок старых постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Число постов, обрабатываемых за один проход.',
+        )
+
+    def handle(self, *args, **options):
+        described, failed = backfill(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Описано картинок: {described}, не прочитано: {failed}'
+        ))
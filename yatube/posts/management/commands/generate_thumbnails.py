@@ -0,0 +1,72 @@
+import os
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts.models import ThumbnailTask
+from posts.thumbnails import process_task
+
+
+class Command(BaseCommand):
+    help = 'Генерирует миниатюры из очереди в нескольких процессах.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Число процессов, 0 - обработка в текущем процессе.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Число задач, выбираемых из очереди за раз.',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Ждать новые задачи вместо завершения.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='Пауза между проверками пустой очереди, секунды.',
+        )
+
+    def pending(self, batch_size):
+        return list(ThumbnailTask.objects.filter(
+            failed=False,
+        ).order_by('pk').values_list('post_id', flat=True)[:batch_size])
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['processes']:
+            # Соединения с базой не должны наследоваться дочерними процессами.
+            connections.close_all()
+            pool = Pool(options['processes'])
+        done = failed = 0
+        try:
+            while True:
+                post_ids = self.pending(options['batch_size'])
+                if not post_ids:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                if pool is None:
+                    results = [process_task(post_id) for post_id in post_ids]
+                else:
+                    results = pool.map(process_task, post_ids)
+                done += sum(results)
+                failed += len(results) - sum(results)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано постов: {done}, с ошибками: {failed}'
+        ))
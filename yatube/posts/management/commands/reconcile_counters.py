@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.counters import (
+    post_ids_chunks,
+    reconcile_posts,
+    reconcile_users,
+    user_ids_chunks,
+)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики постов, подписок и комментариев.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Число записей, пересчитываемых за один проход.',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        users = posts = 0
+        for ids in user_ids_chunks(chunk_size):
+            with transaction.atomic():
+                users += reconcile_users(ids)
+        for ids in post_ids_chunks(chunk_size):
+            with transaction.atomic():
+                posts += reconcile_posts(ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков пользователей: {users}, постов: {posts}'
+        ))
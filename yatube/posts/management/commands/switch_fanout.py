@@ -0,0 +1,61 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.models import FanoutTask
+from posts.timeline import switch_mode
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Меняет режим рассылки постов авторов из очереди.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Число задач, выбираемых из очереди за раз.',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Ждать новые задачи вместо завершения.',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='Пауза между проверками пустой очереди, секунды.',
+        )
+
+    def pending(self, last, batch_size):
+        return list(FanoutTask.objects.filter(pk__gt=last).order_by(
+            'pk',
+        ).values_list('pk', 'author_id')[:batch_size])
+
+    def handle(self, *args, **options):
+        done = failed = last = 0
+        while True:
+            tasks = self.pending(last, options['batch_size'])
+            if not tasks:
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+                last = 0
+                continue
+            for pk, author_id in tasks:
+                try:
+                    switch_mode(author_id)
+                    done += 1
+                except Exception:
+                    logger.exception(
+                        'Не удалось сменить рассылку автора %s', author_id,
+                    )
+                    failed += 1
+            last = tasks[-1][0]
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано авторов: {done}, с ошибками: {failed}'
+        ))
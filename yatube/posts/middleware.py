@@ -0,0 +1,121 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .cache import get_versions, page_etag
+from .constants import PAGE_CACHE_PARAMS, PAGE_CACHE_TIMEOUT
+from .holes import fill_holes, punch_holes
+
+SKIPPED_HEADERS = {'content-length', 'etag'}
+
+
+def page_key(request):
+    """Ключ страницы по адресу с упорядоченными параметрами.
+
+    None, если в запросе есть параметры вне PAGE_CACHE_PARAMS: иначе
+    каждая метка вроде utm_source заводила бы свою копию страницы.
+    """
+    if any(param not in PAGE_CACHE_PARAMS for param in request.GET):
+        return None
+    query = urlencode(sorted(
+        (param, value)
+        for param, values in request.GET.lists()
+        for value in values
+    ))
+    url = request.build_absolute_uri(request.path)
+    if query:
+        url = f'{url}?{query}'
+
+    return f'page:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+class PageCacheMiddleware:
+    """Кэш страниц с пользовательскими фрагментами.
+
+    В кэше хранится скелет страницы, общий для всех посетителей:
+    фрагменты, помеченные тегом hole, вырезаются и заполняются
+    для текущего пользователя при каждой выдаче. Скелет действителен,
+    пока не изменились версии тегов страницы из tagged_page. Гости
+    обслуживаются без обращений к базе.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.is_cacheable_request(request):
+            return self.get_response(request)
+        key = page_key(request)
+        if key is None:
+            return self.get_response(request)
+        entry = cache.get(key)
+        if entry is not None:
+            versions, skeleton = entry
+            if get_versions(versions) == versions:
+                return self.serve(request, versions, skeleton)
+        response = self.get_response(request)
+        if self.is_cacheable_response(request, response):
+            cache.set(
+                key,
+                (request.page_cache_versions, self.skeleton(response)),
+                PAGE_CACHE_TIMEOUT,
+            )
+
+        return response
+
+    def serve(self, request, versions, skeleton):
+        # Фрагменты должны видеть то же представление, что и при промахе.
+        request.resolver_match = resolve(
+            request.path_info, getattr(request, 'urlconf', None),
+        )
+        response = HttpResponse(
+            fill_holes(request, skeleton.content.decode(skeleton.charset)),
+        )
+        for header, value in skeleton.items():
+            response[header] = value
+        response['ETag'] = quote_etag(page_etag(request, versions))
+
+        return get_conditional_response(
+            request, etag=response['ETag'], response=response,
+        )
+
+    def skeleton(self, response):
+        skeleton = HttpResponse(
+            punch_holes(response.content.decode(response.charset)),
+        )
+        for header, value in response.items():
+            if header.lower() not in SKIPPED_HEADERS:
+                skeleton[header] = value
+
+        return skeleton
+
+    def is_cacheable_request(self, request):
+        return request.method in ('GET', 'HEAD') and not self.has_messages(
+            request
+        )
+
+    def has_messages(self, request):
+        """Сообщения в cookie или сессии, сессия гостя не читается."""
+        if CookieStorage.cookie_name in request.COOKIES:
+            return True
+        session = getattr(request, 'session', None)
+        if session is None or session.session_key is None:
+            return False
+
+        return SessionStorage.session_key in session
+
+    def is_cacheable_response(self, request, response):
+        return (
+            response.status_code == 200
+            and hasattr(request, 'page_cache_versions')
+            and not getattr(request, 'page_cache_stale', False)
+            and not response.streaming
+            and 'private' not in response.get('Cache-Control', '')
+        )
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def queue_image_variants(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ThumbnailTask = apps.get_model('posts', 'ThumbnailTask')
+    posts = Post.objects.exclude(image='')
+    queued = set(ThumbnailTask.objects.values_list('post_id', flat=True))
+    ThumbnailTask.objects.bulk_create(
+        ThumbnailTask(post_id=pk)
+        for pk in posts.values_list('pk', flat=True)
+        if pk not in queued
+    )
+    posts.update(thumbnails_ready=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_thumbnail_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(queue_image_variants, migrations.RunPython.noop),
+    ]
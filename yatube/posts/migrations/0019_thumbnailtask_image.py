@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:44
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_images(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ThumbnailTask = apps.get_model('posts', 'ThumbnailTask')
+    ThumbnailTask.objects.update(image=Subquery(
+        Post.objects.filter(pk=OuterRef('post_id')).values('image')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_timelineentry_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailtask',
+            name='image',
+            field=models.CharField(default='', max_length=100, verbose_name='Картинка'),
+        ),
+        migrations.RunPython(copy_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:01
+
+from django.db import migrations, models
+
+# THUMBNAIL_MAX_ATTEMPTS на момент миграции.
+MAX_ATTEMPTS = 3
+
+
+def mark_failed(apps, schema_editor):
+    ThumbnailTask = apps.get_model('posts', 'ThumbnailTask')
+    ThumbnailTask.objects.filter(
+        attempts__gte=MAX_ATTEMPTS,
+    ).update(failed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_thumbnailtask_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thumbnailtask',
+            name='failed',
+            field=models.BooleanField(default=False, verbose_name='Не удалось создать'),
+        ),
+        migrations.RunPython(mark_failed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.16 on 2026-10-17 07:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# FANOUT_MAX_FOLLOWERS на момент миграции.
+MAX_FOLLOWERS = 1000
+
+
+def mark_pulled_authors(apps, schema_editor):
+    UserCounter = apps.get_model('posts', 'UserCounter')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    pulled = UserCounter.objects.filter(followers_count__gt=MAX_FOLLOWERS)
+    pulled.update(fanout_pull=True)
+    TimelineEntry.objects.filter(
+        post__author_id__in=pulled.values('user_id'),
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0020_thumbnailtask_failed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounter',
+            name='fanout_pull',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Посты читаются без рассылки'),
+        ),
+        migrations.CreateModel(
+            name='FanoutTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fanout_task', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Очередь рассылки',
+                'verbose_name_plural': 'Очередь рассылки',
+            },
+        ),
+        migrations.RunPython(mark_pulled_authors, migrations.RunPython.noop),
+    ]
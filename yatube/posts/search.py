@@ -0,0 +1,117 @@
+from django.db import connection, transaction
+
+from .constants import SEARCH_LIMIT
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(query):
+    """Поисковый запрос FTS5: все слова, каждое как префикс."""
+    words = ('"{}"*'.format(word.replace('"', '""')) for word in query.split())
+
+    return ' '.join(words)
+
+
+def index_posts(posts):
+    """Запись текстов постов в полнотекстовый индекс."""
+    if not fts_available():
+        return
+    rows = [(post.pk, post.text) for post in posts]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(pk,) for pk, _ in rows],
+        )
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            rows,
+        )
+
+
+def unindex_posts(post_ids):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(pk,) for pk in post_ids],
+        )
+
+
+def rebuild_index(batch_size):
+    """Переиндексация всех постов порциями, возвращает их число.
+
+    Индекс перестраивается в одной транзакции, и поиск до ее конца
+    видит старый индекс, а не пустой.
+    """
+    last = total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        while True:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, text) '
+                f'SELECT id, text FROM {Post._meta.db_table} '
+                'WHERE id > %s ORDER BY id LIMIT %s',
+                [last, batch_size],
+            )
+            if cursor.rowcount <= 0:
+                break
+            total += cursor.rowcount
+            cursor.execute(f'SELECT MAX(rowid) FROM {FTS_TABLE}')
+            last = cursor.fetchone()[0]
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"
+        )
+
+    return total
+
+
+def filter_posts(queryset, query):
+    """Посты из queryset, подходящие под запрос, без ограничения числа."""
+    if not query.split():
+        return queryset.none()
+    if not fts_available():
+        return queryset.filter(text__icontains=query.strip())
+
+    return queryset.extra(
+        where=[
+            f'{Post._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[fts_query(query)],
+    )
+
+
+def search_post_ids(query, group=None, author=None, limit=SEARCH_LIMIT):
+    """Идентификаторы найденных постов, самые релевантные первыми."""
+    if not query.split():
+        return []
+    if not fts_available():
+        posts = Post.objects.filter(text__icontains=query.strip())
+        if group is not None:
+            posts = posts.filter(group=group)
+        if author is not None:
+            posts = posts.filter(author=author)
+        return list(posts.values_list('pk', flat=True)[:limit])
+    sql = (
+        f'SELECT fts.rowid FROM {FTS_TABLE} fts '
+        f'JOIN {Post._meta.db_table} post ON post.id = fts.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s'
+    )
+    params = [fts_query(query)]
+    if group is not None:
+        sql += ' AND post.group_id = %s'
+        params.append(group.pk)
+    if author is not None:
+        sql += ' AND post.author_id = %s'
+        params.append(author.pk)
+    sql += ' ORDER BY fts.rank LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,208 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import storage
+from . import images, search, thumbnails, timeline
+from .cache import bump_version, post_feeds, shift_count, drop_count
+from .counters import shift_comments, shift_counter
+from .models import Comment, Follow, Group, Post, User, UserCounter
+
+
+@receiver(pre_save, sender=Post)
+def remember_saved_post(sender, instance, **kwargs):
+    """Группа и картинка поста до редактирования."""
+    saved = None
+    if instance.pk is not None:
+        saved = Post.objects.filter(pk=instance.pk).values_list(
+            'group_id',
+            'image',
+        ).first()
+    instance.saved_group_id, instance.saved_image = saved or (None, '')
+    instance.image_changed = (
+        (instance.image.name or '') != instance.saved_image
+    )
+    # Ссылку на загружаемый файл берет само хранилище при сохранении.
+    instance.image_uploaded = bool(instance.image) and (
+        not instance.image._committed
+    )
+    if instance.image_changed:
+        instance.thumbnails_ready = False
+        images.describe_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        shift_count(1, *post_feeds(instance.author_id, instance.group_id))
+    elif instance.saved_group_id != instance.group_id:
+        if instance.saved_group_id:
+            shift_count(-1, f'group:{instance.saved_group_id}')
+        if instance.group_id:
+            shift_count(1, f'group:{instance.group_id}')
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    shift_count(-1, *post_feeds(instance.author_id, instance.group_id))
+
+
+@receiver((post_save, post_delete), sender=Post)
+def invalidate_post_anchors(sender, instance, created=False, **kwargs):
+    """Новый, удаленный или перенесенный пост сдвигает границы страниц.
+
+    Правка текста порядок лент не меняет, и якоря остаются.
+    """
+    if (
+        created
+        or kwargs['signal'] is post_delete
+        or instance.saved_group_id != instance.group_id
+    ):
+        bump_version('posts')
+
+
+@receiver((post_save, post_delete), sender=Post)
+def invalidate_post_feeds(sender, instance, **kwargs):
+    """Сброс кэша страниц лент, в которых показан пост."""
+    feeds = post_feeds(instance.author_id, instance.group_id)
+    saved_group_id = getattr(instance, 'saved_group_id', None)
+    if saved_group_id:
+        feeds.append(f'group:{saved_group_id}')
+    bump_version(*feeds)
+
+
+@receiver((post_save, post_delete), sender=Post)
+def invalidate_post_page(sender, instance, created=False, **kwargs):
+    """Страница поста и число постов в профиле автора."""
+    bump_version(f'post:{instance.pk}')
+    if created or kwargs['signal'] is post_delete:
+        bump_version(f'author:{instance.author_id}')
+
+
+@receiver((post_save, post_delete), sender=Group)
+def invalidate_group_cards(sender, instance, **kwargs):
+    """Карточки постов группы содержат ссылку на нее."""
+    Post.objects.filter(group=instance).update(updated=timezone.now())
+    bump_version('cards')
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_cards(sender, instance, created, update_fields=None,
+                            **kwargs):
+    """Карточки постов автора содержат ссылку на его профиль."""
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    Post.objects.filter(author=instance).update(updated=timezone.now())
+    bump_version('cards')
+
+
+@receiver((post_save, post_delete), sender=Comment)
+def invalidate_comment_feeds(sender, instance, **kwargs):
+    post = Post.objects.filter(pk=instance.post_id).values_list(
+        'author_id',
+        'group_id',
+    ).first()
+    if post:
+        bump_version(*post_feeds(*post))
+    bump_version(f'post:{instance.post_id}')
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_follow_count(sender, instance, **kwargs):
+    drop_count(f'follow:{instance.user_id}')
+    bump_version(f'follow:{instance.user_id}', f'author:{instance.author_id}')
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_unfollowed_posts(sender, instance, **kwargs):
+    timeline.unfollow(instance)
+
+
+@receiver(post_save, sender=User)
+def create_user_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserCounter.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_author_post(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(instance.author_id, 'posts_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_author_post(sender, instance, **kwargs):
+    shift_counter(instance.author_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(instance.author_id, 'followers_count', 1)
+        shift_counter(instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    shift_counter(instance.author_id, 'followers_count', -1)
+    shift_counter(instance.user_id, 'following_count', -1)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def check_fanout_mode(sender, instance, **kwargs):
+    # После счетчиков: режим выбирается по новому числу подписчиков.
+    timeline.check_mode(instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        shift_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    shift_comments(instance.post_id, -1)
+    bump_version(f'comments:{instance.post_id}')
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, **kwargs):
+    search.index_posts([instance])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.unindex_posts([instance.pk])
+
+
+@receiver(post_save, sender=Post)
+def enqueue_thumbnails(sender, instance, **kwargs):
+    """Миниатюры создаются фоновым процессом, а не при показе страницы."""
+    if instance.image_changed and instance.image:
+        thumbnails.enqueue(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_image_references(sender, instance, **kwargs):
+    if instance.image_changed:
+        if not instance.image_uploaded:
+            storage.acquire(instance.image.name)
+        storage.release(instance.saved_image, instance.image.storage)
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    storage.release(instance.image.name, instance.image.storage)
@@ -0,0 +1,55 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts.cache import cached, mark_stale
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, timeout, name, key, stale_key):
+        self.nodelist = nodelist
+        self.timeout = timeout
+        self.name = name
+        self.key = key
+        self.stale_key = stale_key
+
+    def render(self, context):
+        content, stale = cached(
+            make_template_fragment_key(
+                self.name, [self.key.resolve(context)],
+            ),
+            lambda: self.nodelist.render(context),
+            self.timeout.resolve(context),
+            make_template_fragment_key(
+                f'{self.name}:stale', [self.stale_key.resolve(context)],
+            ),
+        )
+        if stale:
+            mark_stale(context.get('request'))
+
+        return content
+
+
+@register.tag
+def fragment_cache(parser, token):
+    """Кэш фрагмента шаблона с защитой от одновременного пересчета.
+
+    {% fragment_cache timeout name key stale_key %}...{% endfragment_cache %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 5:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает timeout, name, key и stale_key.'
+        )
+    nodelist = parser.parse(('endfragment_cache',))
+    parser.delete_first_token()
+    timeout, name, key, stale_key = bits[1:]
+
+    return FragmentCacheNode(
+        nodelist,
+        parser.compile_filter(timeout),
+        name,
+        parser.compile_filter(key),
+        parser.compile_filter(stale_key),
+    )
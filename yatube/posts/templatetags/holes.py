@@ -0,0 +1,16 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.holes import mark_hole, render_hole
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **params):
+    """Фрагмент, зависящий от пользователя, в кэше страниц не хранится."""
+    params = {key: str(value) for key, value in params.items()}
+
+    return mark_safe(
+        mark_hole(name, params, render_hole(context.request, name, params))
+    )
@@ -0,0 +1,37 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.cache import card_key
+from posts.constants import CARD_CACHE_TIMEOUT
+from posts.thumbnails import preload_thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Карточки постов из кэша, недостающие рендерятся и кэшируются."""
+    group = context.get('group')
+    posts = {card_key(post, group): post for post in posts}
+    cards = cache.get_many(posts)
+    missing = {
+        key: post for key, post in posts.items() if key not in cards
+    }
+    variants = preload_thumbnails(missing.values())
+    missing = {
+        key: render_to_string(
+            'posts/includes/post_card.html',
+            {
+                'post': post,
+                'group': group,
+                'variants': variants.get(post.pk, {}),
+            },
+        )
+        for key, post in missing.items()
+    }
+    cache.set_many(missing, CARD_CACHE_TIMEOUT)
+    cards.update(missing)
+
+    return [mark_safe(cards[key]) for key in posts]
@@ -0,0 +1,36 @@
+from django import template
+
+from posts.constants import IMAGE_SIZES
+from posts.thumbnails import preload_thumbnails
+
+register = template.Library()
+
+
+def srcset(images):
+    return ', '.join(f'{image.url} {image.width}w' for image in images)
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(post, variants=None):
+    """Картинка поста в нескольких ширинах и форматах.
+
+    Пока миниатюры не готовы, показывается оригинал с сохраненными
+    размерами: при показе страницы картинка не читается.
+    """
+    if variants is None:
+        variants = preload_thumbnails([post]).get(post.pk)
+    if not variants:
+        return {'post': post}
+    variants = dict(variants)
+    fallback = variants.pop('jpeg')
+
+    return {
+        'post': post,
+        'sources': [
+            (f'image/{image_format}', srcset(images))
+            for image_format, images in variants.items()
+        ],
+        'image': fallback[-1],
+        'srcset': srcset(fallback),
+        'sizes': IMAGE_SIZES,
+    }
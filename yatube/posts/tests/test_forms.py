@@ -1,14 +1,22 @@
+import hashlib
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+
+from core.models import StoredFile
+from posts.constants import IMAGE_MAX_SIZE
 
 from posts.models import Post, Group, Comment, User
 from posts.forms import PostForm
 
+ORIENTATION = 0x0112
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
@@ -85,7 +93,11 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(form_data['text'], posts_new[0].text)
         self.assertEqual(form_data['group'], posts_new[0].group.id)
         self.assertEqual(self.user, posts_new[0].author)
-        self.assertEqual(self.post.image, posts_new[0].image)
+        digest = hashlib.sha256(posts_new[0].image.read()).hexdigest()
+        self.assertEqual(
+            posts_new[0].image,
+            f'posts/{digest[:2]}/{digest[2:4]}/{digest}.jpg',
+        )
 
     def test_edit_post(self):
         """Валидная форма изменяет запись в Post."""
@@ -114,7 +126,46 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(post_edit.text, form_data['text'])
         self.assertEqual(post_edit.group.id, form_data['group'])
         self.assertEqual(post_edit.author, self.user)
-        self.assertEqual(post_edit.image, 'posts/small.gif')
+        digest = hashlib.sha256(post_edit.image.read()).hexdigest()
+        self.assertEqual(
+            post_edit.image,
+            f'posts/{digest[:2]}/{digest[2:4]}/{digest}.jpg',
+        )
+
+    def test_uploaded_image_is_normalized(self):
+        """Картинка уменьшается, поворачивается по EXIF и теряет EXIF."""
+        exif = Image.Exif()
+        exif[ORIENTATION] = 6
+        buffer = BytesIO()
+        Image.new('RGB', (3000, 1000), 'red').save(
+            buffer, 'JPEG', exif=exif.tobytes(),
+        )
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.id}),
+            data={
+                'text': 'Большая картинка',
+                'image': SimpleUploadedFile('photo.JPG', buffer.getvalue()),
+            },
+        )
+        post = Post.objects.get(id=self.post.id)
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.height, IMAGE_MAX_SIZE)
+            self.assertLess(image.width, image.height)
+            self.assertNotIn('exif', image.info)
+            self.assertTrue(image.info.get('progressive'))
+
+    def test_failed_edit_keeps_no_file_reference(self):
+        """Ошибка при сохранении поста откатывает ссылку на файл."""
+        with mock.patch(
+            'posts.signals.thumbnails.enqueue', side_effect=OSError,
+        ), self.assertRaises(OSError):
+            self.authorized_client.post(
+                reverse('posts:post_edit', kwargs={'post_id': self.post.id}),
+                data={'text': 'Не сохранится', 'image': self.uploaded},
+            )
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertFalse(Post.objects.get(id=self.post.id).image)
 
     def test_comment_to_post_detail(self):
         """Комментарий появляется на странице поста."""
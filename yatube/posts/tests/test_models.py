@@ -1,12 +1,39 @@
+import os
 import shutil
 import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db.models.signals import post_save
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
 
-from ..models import Group, Post, User
-from ..constants import LIMIT_POSTS
+from core.models import StoredFile
+from core.storage import acquire
+
+from ..models import (
+    Comment,
+    Follow,
+    Group,
+    Post,
+    ThumbnailTask,
+    User,
+    UserCounter,
+)
+from ..constants import (
+    LIMIT_POSTS,
+    THUMBNAIL_GEOMETRIES,
+    THUMBNAIL_MAX_ATTEMPTS,
+)
+from ..garbage import MediaCollector, RateLimit, walk
+from ..images import dominant_color
+from ..thumbnails import generate, process_task
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -81,3 +108,394 @@ class PostModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     self.post._meta.get_field(field).help_text, expected_value)
+
+
+class CounterModelTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def test_counters_follow_changes(self):
+        """Счетчики меняются вместе с постами, подписками и комментариями."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        self.author.counter.refresh_from_db()
+        self.reader.counter.refresh_from_db()
+        post.refresh_from_db()
+        self.assertEqual(self.author.counter.posts_count, 1)
+        self.assertEqual(self.author.counter.followers_count, 1)
+        self.assertEqual(self.reader.counter.following_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        follow.delete()
+        post.delete()
+        self.author.counter.refresh_from_db()
+        self.reader.counter.refresh_from_db()
+        self.assertEqual(self.author.counter.posts_count, 0)
+        self.assertEqual(self.author.counter.followers_count, 0)
+        self.assertEqual(self.reader.counter.following_count, 0)
+
+    def test_counters_do_not_go_below_zero(self):
+        """Разошедшийся с данными счетчик не уходит ниже нуля."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Текст',
+        )
+        UserCounter.objects.filter(user=self.author).update(
+            followers_count=0,
+        )
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        follow.delete()
+        comment.delete()
+        self.author.counter.refresh_from_db()
+        post.refresh_from_db()
+        self.assertEqual(self.author.counter.followers_count, 0)
+        self.assertEqual(post.comments_count, 0)
+
+    def test_reconcile_counters(self):
+        """Команда reconcile_counters исправляет расхождения."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        UserCounter.objects.filter(user=self.author).update(posts_count=7)
+        Post.objects.filter(pk=post.pk).update(comments_count=0)
+        UserCounter.objects.filter(user=self.reader).delete()
+        call_command('reconcile_counters', chunk_size=1, stdout=StringIO())
+        self.assertEqual(
+            UserCounter.objects.get(user=self.author).posts_count, 1,
+        )
+        self.assertTrue(UserCounter.objects.filter(user=self.reader).exists())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailQueueTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(buffer, 'JPEG')
+
+        return SimpleUploadedFile('red.jpg', buffer.getvalue())
+
+    def test_image_upload_is_queued(self):
+        """Пост с картинкой ставится в очередь миниатюр."""
+        post = Post.objects.create(author=self.user, text='Без картинки')
+        self.assertFalse(ThumbnailTask.objects.filter(post=post).exists())
+        post.image = self.image()
+        post.save()
+        self.assertTrue(ThumbnailTask.objects.filter(post=post).exists())
+        self.assertFalse(post.thumbnails_ready)
+
+    def test_worker_generates_thumbnails(self):
+        """Команда generate_thumbnails обрабатывает очередь."""
+        post = Post.objects.create(
+            author=self.user,
+            text='С картинкой',
+            image=self.image(),
+        )
+        call_command('generate_thumbnails', processes=0, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+        self.assertFalse(ThumbnailTask.objects.exists())
+        post.text = 'Новый текст'
+        post.save()
+        self.assertFalse(ThumbnailTask.objects.exists())
+
+    def test_reupload_during_processing_stays_queued(self):
+        """Картинка, загруженная во время обработки, не теряется."""
+        post = Post.objects.create(
+            author=self.user,
+            text='С картинкой',
+            image=self.image(),
+        )
+
+        def reupload(post):
+            Post.objects.filter(pk=post.pk).update(image='posts/new.jpg')
+            ThumbnailTask.objects.filter(post=post).update(
+                image='posts/new.jpg',
+            )
+            generate(post)
+
+        with mock.patch('posts.thumbnails.generate', reupload):
+            self.assertTrue(process_task(post.pk))
+        post.refresh_from_db()
+        self.assertFalse(post.thumbnails_ready)
+        self.assertEqual(
+            ThumbnailTask.objects.get(post=post).image, 'posts/new.jpg',
+        )
+
+    def test_ready_mark_skips_post_save(self):
+        """Отметка готовности миниатюр не вызывает сигналы поста."""
+        post = Post.objects.create(
+            author=self.user,
+            text='С картинкой',
+            image=self.image(),
+        )
+        receiver = mock.Mock()
+        post_save.connect(receiver, sender=Post)
+        self.addCleanup(post_save.disconnect, receiver, sender=Post)
+        self.assertTrue(process_task(post.pk))
+        receiver.assert_not_called()
+        post.refresh_from_db()
+        self.assertTrue(post.thumbnails_ready)
+
+    def test_broken_image_is_retried_limited_times(self):
+        """Битая картинка не блокирует очередь навсегда."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Битая картинка',
+            image=SimpleUploadedFile('broken.jpg', b'not an image'),
+        )
+        with self.assertLogs('posts.thumbnails', 'ERROR'), \
+                self.assertLogs('sorl.thumbnail', 'ERROR'):
+            call_command(
+                'generate_thumbnails', processes=0, stdout=StringIO(),
+            )
+        post.refresh_from_db()
+        self.assertFalse(post.thumbnails_ready)
+        self.assertEqual(
+            ThumbnailTask.objects.get(post=post).attempts,
+            THUMBNAIL_MAX_ATTEMPTS,
+        )
+        self.assertTrue(ThumbnailTask.objects.get(post=post).failed)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageMetadataTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), (255, 0, 0)).save(buffer, 'PNG')
+
+        return SimpleUploadedFile('red.png', buffer.getvalue())
+
+    def test_metadata_is_stored_on_upload(self):
+        """Размеры, цвет и превью сохраняются вместе с картинкой."""
+        image = self.image()
+        post = Post.objects.create(
+            author=self.user, text='Картинка', image=image,
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (40, 20))
+        self.assertEqual(post.image_size, image.size)
+        self.assertEqual(post.image_color, '#ff0000')
+        self.assertTrue(
+            post.image_preview.startswith('data:image/jpeg;base64,')
+        )
+
+    def test_color_is_dominant_not_average(self):
+        """Цвет картинки - самый частый, а не средний."""
+        image = Image.new('RGB', (40, 20), (255, 0, 0))
+        image.paste((0, 0, 255), (30, 0, 40, 20))
+        self.assertEqual(dominant_color(image), (255, 0, 0))
+
+    def test_describe_images_backfills_old_posts(self):
+        """Команда describe_images описывает уже загруженные картинки."""
+        post = Post.objects.create(
+            author=self.user, text='Картинка', image=self.image(),
+        )
+        Post.objects.filter(pk=post.pk).update(
+            image_width=None, image_height=None, image_preview='',
+        )
+        call_command('describe_images', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (40, 20))
+        self.assertTrue(post.image_preview)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@mock.patch('core.storage.transaction.on_commit', lambda func: func())
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name='meme.gif'):
+        buffer = BytesIO()
+        Image.new('RGB', (4, 4), 'green').save(buffer, 'GIF')
+
+        return Post.objects.create(
+            author=self.user,
+            text='Мем',
+            image=SimpleUploadedFile(name, buffer.getvalue()),
+        )
+
+    def test_duplicates_share_one_file(self):
+        """Одинаковые картинки хранятся одним файлом."""
+        first = self.create_post()
+        second = self.create_post('copy.GIF')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            StoredFile.objects.get(name=first.image.name).references, 2,
+        )
+
+    def test_file_is_deleted_without_references(self):
+        """Файл удаляется, когда на него не остается ссылок."""
+        first = self.create_post()
+        second = self.create_post()
+        storage = first.image.storage
+        first.delete()
+        self.assertTrue(storage.exists(second.image.name))
+        second.image = None
+        second.save()
+        self.assertFalse(storage.exists(first.image.name))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_reference_is_taken_before_existing_file_is_reused(self):
+        """Повторная загрузка не теряет файл, удаляемый после коммита."""
+        first = self.create_post()
+        storage = first.image.storage
+        callbacks = []
+        with mock.patch(
+            'core.storage.transaction.on_commit', callbacks.append,
+        ):
+            first.delete()
+            buffer = BytesIO()
+            Image.new('RGB', (4, 4), 'green').save(buffer, 'GIF')
+            name = storage.save(
+                'posts/again.gif',
+                SimpleUploadedFile('again.gif', buffer.getvalue()),
+            )
+        for callback in callbacks:
+            callback()
+        self.assertEqual(name, first.image.name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaCollectorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), 'red').save(buffer, 'JPEG')
+        self.post = Post.objects.create(
+            author=self.user,
+            text='Картинка',
+            image=SimpleUploadedFile('red.jpg', buffer.getvalue()),
+        )
+        self.storage = self.post.image.storage
+        self.orphan = self.create_file('posts/a/orphan.gif')
+        self.fresh = self.create_file('posts/a-b.gif', age=0)
+        self.thumbnail = self.create_file('cache/00/11/stale.jpg')
+
+    def create_file(self, name, age=7200):
+        path = self.storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'gif')
+        os.utime(path, (time.time() - age,) * 2)
+
+        return name
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_media', *args, stdout=out)
+
+        return out.getvalue()
+
+    def test_walk_finds_nested_files(self):
+        """Обход диска находит файлы во всех вложенных каталогах."""
+        self.create_file('posts/a.gif')
+        files = walk(self.storage, 'posts', RateLimit(0))
+        self.assertEqual(
+            {name for name, _ in files},
+            {
+                self.post.image.name,
+                self.orphan,
+                self.fresh,
+                'posts/a.gif',
+            },
+        )
+
+    def test_dry_run_keeps_files(self):
+        """В режиме dry-run ничего не удаляется."""
+        self.assertIn('картинок: 1, миниатюр: 1', self.collect('--dry-run'))
+        self.assertTrue(self.storage.exists(self.orphan))
+        self.assertTrue(self.storage.exists(self.thumbnail))
+
+    def test_orphans_are_deleted(self):
+        """Удаляются только старые файлы без ссылок."""
+        self.collect()
+        self.assertFalse(self.storage.exists(self.orphan))
+        self.assertFalse(self.storage.exists(self.thumbnail))
+        self.assertTrue(self.storage.exists(self.fresh))
+        self.assertTrue(self.storage.exists(self.post.image.name))
+
+    def test_files_with_references_are_kept(self):
+        """Файл, на который взяли ссылку после проверки постов, остается."""
+        is_old = MediaCollector.is_old
+
+        def acquire_orphan(collector, entry):
+            if entry.name == 'orphan.gif':
+                acquire(self.orphan)
+            return is_old(collector, entry)
+
+        with mock.patch.object(MediaCollector, 'is_old', acquire_orphan):
+            self.assertIn('картинок: 0', self.collect())
+        self.assertTrue(self.storage.exists(self.orphan))
+        self.assertEqual(
+            StoredFile.objects.get(name=self.orphan).references, 1,
+        )
+
+    def test_orphans_are_quarantined(self):
+        """Картинки без ссылок переносятся в карантин."""
+        with self.assertRaises(CommandError):
+            self.collect(
+                '--quarantine', os.path.join(TEMP_MEDIA_ROOT, 'quarantine'),
+            )
+        quarantine = os.path.join(TEMP_MEDIA_ROOT, '.quarantine')
+        self.collect('--quarantine', quarantine)
+        self.assertFalse(self.storage.exists(self.orphan))
+        self.assertTrue(
+            os.path.exists(os.path.join(quarantine, self.orphan))
+        )
+
+    def test_stale_kvstore_entries_are_deleted(self):
+        """Миниатюры картинки без поста удаляются вместе с kvstore."""
+        call_command('generate_thumbnails', processes=0, stdout=StringIO())
+        thumbnail = get_thumbnail(
+            self.post.image, *THUMBNAIL_GEOMETRIES[0][:1],
+            **THUMBNAIL_GEOMETRIES[0][1],
+        )
+        Post.objects.filter(pk=self.post.pk).update(image='')
+        self.assertIn('записей kvstore: 1', self.collect())
+        self.assertFalse(self.storage.exists(thumbnail.name))
+        self.assertIsNone(default.kvstore.get(ImageFile(self.post.image)))
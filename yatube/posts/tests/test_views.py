@@ -1,17 +1,50 @@
+import os
 import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from io import BytesIO, StringIO
+from time import sleep, time
+from unittest import mock
 
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import reverse
 from django import forms
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from sorl.thumbnail import get_thumbnail
 
-from posts.models import Post, Group, Follow, User, Comment
-from ..constants import NUMB_OF_POSTS, NUMB_OF_POSTS_TEST, NUMB_OF_POSTS_2
+from posts.cache import cached, get_version
+from posts.models import (
+    Comment,
+    FanoutTask,
+    Follow,
+    Group,
+    Post,
+    User,
+    UserCounter,
+)
+from ..constants import (
+    IMAGE_WIDTHS,
+    NUMB_OF_COMMENTS,
+    NUMB_OF_POSTS,
+    NUMB_OF_POSTS_TEST,
+    NUMB_OF_POSTS_2,
+    THUMBNAIL_GEOMETRIES,
+)
 from posts.forms import PostForm, CommentForm
+from posts.holes import fill_holes
+from posts.middleware import PageCacheMiddleware, page_key
+from posts.search import filter_posts, unindex_posts
+from posts.thumbnails import preload_thumbnails, thumbnail_file
+from posts.timeline import TimelinePaginator
+from posts.utils import encode_cursor
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
@@ -55,6 +88,7 @@ class PostPagesTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(PostPagesTests.user)
         self.user_follow_client = Client()
@@ -236,13 +270,35 @@ class PostPagesTests(TestCase):
             group=self.group,
         )
         response1 = self.authorized_client.get(reverse('posts:index'))
-        Post.objects.filter(id=post_new.id).delete()
+        Post.objects.filter(id=post_new.id).update(text='Без сигналов')
         response2 = self.authorized_client.get(reverse('posts:index'))
         self.assertEqual(response1.content, response2.content)
         cache.clear()
         response3 = self.authorized_client.get(reverse('posts:index'))
         self.assertNotEqual(response1.content, response3.content)
 
+    def test_feed_cache_invalidation(self):
+        """Изменение поста сбрасывает кэш всех его лент."""
+        post_new = Post.objects.create(
+            author=self.user,
+            text='Проверка инвалидации',
+            group=self.group,
+        )
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+        )
+        for url in urls:
+            self.assertContains(self.authorized_client.get(url), post_new.text)
+        post_new.delete()
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertNotContains(
+                    self.authorized_client.get(url),
+                    post_new.text,
+                )
+
     def test_following(self):
         """Пользователь может подписываться на других пользователей."""
         user_new = User.objects.create_user(username='NoName')
@@ -383,6 +439,7 @@ class PaginatorViewsTest(TestCase):
             )
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(PaginatorViewsTest.user)
 
@@ -426,3 +483,864 @@ class PaginatorViewsTest(TestCase):
                     response.context['page_obj'].object_list[0],
                     post,
                 )
+
+    def test_cursor_pagination(self):
+        """Курсоры ведут на соседние страницы ленты."""
+        url = reverse('posts:index')
+        first_page = self.client.get(url).context['page_obj']
+        response = self.client.get(
+            url + f'?after={first_page.next_cursor}'
+        )
+        second_page = response.context['page_obj']
+        self.assertEqual(second_page.number, 2)
+        self.assertEqual(len(second_page), NUMB_OF_POSTS_2)
+        self.assertNotIn(second_page[0], first_page)
+        response = self.client.get(
+            url + f'?before={second_page.previous_cursor}'
+        )
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(
+            list(response.context['page_obj']),
+            list(first_page),
+        )
+
+    def test_page_jump_matches_cursor(self):
+        """Переход по номеру и по курсору дает одну и ту же страницу."""
+        for i in range(NUMB_OF_POSTS * 2):
+            Post.objects.create(author=self.user, text=f'Еще пост {i}')
+        url = reverse('posts:profile', kwargs={'username': self.user.username})
+        by_number = self.client.get(url + '?page=2').context['page_obj']
+        first_page = self.client.get(url).context['page_obj']
+        by_cursor = self.client.get(
+            url + f'?after={first_page.next_cursor}'
+        ).context['page_obj']
+        self.assertEqual(list(by_number), list(by_cursor))
+        self.assertEqual(
+            list(self.client.get(url + '?page=3').context['page_obj']),
+            list(Post.objects.filter(author=self.user)[20:30]),
+        )
+
+    def test_forged_cursor_does_not_move_pages(self):
+        """Курсор от клиента не меняет страницы по номеру для всех."""
+        for i in range(NUMB_OF_POSTS * 2):
+            Post.objects.create(author=self.user, text=f'Еще пост {i}')
+        url = reverse('posts:index')
+        deep = Post.objects.all()[NUMB_OF_POSTS * 2 + 3]
+        forged = encode_cursor(3, deep.pub_date, deep.pk)
+        self.client.get(url + f'?after={forged}')
+        self.assertEqual(
+            list(self.client.get(url + '?page=3').context['page_obj']),
+            list(Post.objects.all()[NUMB_OF_POSTS * 2:NUMB_OF_POSTS * 3]),
+        )
+
+    def test_text_edit_keeps_anchors(self):
+        """Правка текста не сбрасывает якоря страниц."""
+        version = get_version('posts')
+        self.post.text = 'Исправленный текст'
+        self.post.save()
+        self.assertEqual(get_version('posts'), version)
+        self.post.group = None
+        self.post.save()
+        self.assertNotEqual(get_version('posts'), version)
+
+    def test_feed_count_is_cached(self):
+        """Число постов ленты не пересчитывается на каждый запрос."""
+        url = reverse('posts:index')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries)
+        )
+        Post.objects.create(author=self.user, text='Новый пост')
+        response = self.client.get(url)
+        self.assertEqual(
+            response.context['page_obj'].paginator.count,
+            NUMB_OF_POSTS_TEST + 1,
+        )
+
+    def test_page_window(self):
+        """Ссылки выводятся только для страниц рядом с текущей."""
+        for i in range(NUMB_OF_POSTS * 5):
+            Post.objects.create(author=self.user, text=f'Еще пост {i}')
+        response = self.client.get(reverse('posts:index') + '?page=4')
+        self.assertEqual(
+            list(response.context['page_obj'].page_window),
+            [2, 3, 4, 5, 6],
+        )
+
+    def test_feed_cache_varies_by_page(self):
+        """Страницы ленты кэшируются отдельно."""
+        url = reverse('posts:index')
+        self.client.get(url)
+        response = self.client.get(url + '?page=2')
+        self.assertContains(response, 'Тестовый пост 0')
+        self.assertNotContains(
+            response,
+            f'Тестовый пост {NUMB_OF_POSTS_TEST - 1}',
+        )
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(
+            author=cls.author,
+            text='Пост до подписки',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(TimelineTests.reader)
+
+    def test_timeline_follows_subscriptions(self):
+        """Лента подписок заполняется при подписке и новом посте."""
+        self.reader_client.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.author.username},
+        ))
+        post_new = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertEqual(
+            set(self.reader.timeline.values_list('post_id', flat=True)),
+            {self.old_post.id, post_new.id},
+        )
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [post_new, self.old_post],
+        )
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username},
+        ))
+        self.assertFalse(self.reader.timeline.exists())
+
+    @mock.patch('posts.timeline.TIMELINE_LENGTH', 2)
+    def test_timeline_is_trimmed(self):
+        """Лента подписок хранит ограниченное число постов."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+            for i in range(3)
+        ]
+        self.assertEqual(
+            set(self.reader.timeline.values_list('post_id', flat=True)),
+            {posts[1].id, posts[2].id},
+        )
+
+    @mock.patch('posts.timeline.FANOUT_MAX_FOLLOWERS', 1)
+    @mock.patch('posts.timeline.FANOUT_RESUME_FOLLOWERS', 1)
+    def test_pulled_authors_are_merged_and_backfilled(self):
+        """Посты авторов без рассылки сливаются с лентой и дописываются."""
+        popular = User.objects.create_user(username='popular')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=popular)
+        pushed = Post.objects.create(author=popular, text='Разосланный пост')
+        Follow.objects.create(user=fan, author=popular)
+        call_command('switch_fanout', stdout=StringIO())
+        posts = [
+            Post.objects.create(author=author, text=f'Пост {i}')
+            for i, author in enumerate((popular, self.author, popular))
+        ]
+        self.assertEqual(
+            set(self.reader.timeline.values_list('post_id', flat=True)),
+            {self.old_post.id, posts[1].id},
+        )
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']),
+            [*posts[::-1], pushed, self.old_post],
+        )
+        self.assertEqual(
+            TimelinePaginator(self.reader, 10, 'follow:test').total(), 5,
+        )
+        Follow.objects.filter(user=fan, author=popular).delete()
+        self.assertEqual(self.reader.timeline.count(), 2)
+        call_command('switch_fanout', stdout=StringIO())
+        self.assertEqual(
+            set(self.reader.timeline.values_list('post_id', flat=True)),
+            {self.old_post.id, pushed.id, *(post.id for post in posts)},
+        )
+
+    @mock.patch('posts.timeline.FANOUT_MAX_FOLLOWERS', 2)
+    @mock.patch('posts.timeline.FANOUT_RESUME_FOLLOWERS', 1)
+    def test_fanout_mode_has_hysteresis(self):
+        """Режим рассылки не меняется на каждой подписке у границы."""
+        fans = [
+            User.objects.create_user(username=f'fan{i}') for i in range(3)
+        ]
+        for fan in fans:
+            Follow.objects.create(user=fan, author=self.author)
+        self.assertTrue(FanoutTask.objects.filter(author=self.author))
+        call_command('switch_fanout', stdout=StringIO())
+        self.assertTrue(
+            UserCounter.objects.get(user=self.author).fanout_pull,
+        )
+        Follow.objects.filter(user=fans[0]).delete()
+        self.assertFalse(FanoutTask.objects.exists())
+        Follow.objects.filter(user=fans[1]).delete()
+        self.assertTrue(FanoutTask.objects.filter(author=self.author))
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            text='Тестовый пост',
+            group=cls.group,
+        )
+        cls.template = Template(
+            '{% load post_cards %}{% post_cards posts as cards %}'
+            '{% for card in cards %}{{ card }}{% endfor %}'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, **context):
+        posts = Post.objects.select_related('author', 'group')
+
+        return self.template.render(Context({'posts': posts, **context}))
+
+    def test_card_is_cached_until_post_changes(self):
+        """Карточка берется из кэша, пока пост не изменился."""
+        self.render()
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
+        self.assertIn('Тестовый пост', self.render())
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Измененный пост'
+        post.save()
+        self.assertIn('Измененный пост', self.render())
+
+    def test_card_varies_by_group_page(self):
+        """На странице группы карточка не ссылается на эту же группу."""
+        group_url = reverse('posts:group_list', args=(self.group.slug,))
+        self.assertIn(group_url, self.render())
+        self.assertNotIn(group_url, self.render(group=self.group))
+
+    def test_group_change_invalidates_cards(self):
+        """Изменение группы обновляет карточки ее постов."""
+        self.render()
+        self.group.slug = 'new-slug'
+        self.group.save()
+        self.assertIn(
+            reverse('posts:group_list', args=('new-slug',)),
+            self.render(),
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailPreloadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        for number in range(3):
+            buffer = BytesIO()
+            Image.new('RGB', (40, 20), 'blue').save(buffer, 'JPEG')
+            Post.objects.create(
+                author=cls.user,
+                text=f'Пост {number}',
+                image=SimpleUploadedFile(f'{number}.jpg', buffer.getvalue()),
+            )
+        call_command('generate_thumbnails', processes=0, stdout=StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_preload_matches_sorl(self):
+        """Предзагруженные варианты совпадают с get_thumbnail."""
+        posts = list(Post.objects.all())
+        variants = preload_thumbnails(posts)
+        for post in posts:
+            images = variants[post.pk]['webp'] + variants[post.pk]['jpeg']
+            for image, (geometry, options) in zip(
+                images, THUMBNAIL_GEOMETRIES
+            ):
+                self.assertEqual(
+                    image.url,
+                    get_thumbnail(post.image, geometry, **options).url,
+                )
+
+    def test_thumbnail_names_match_sorl(self):
+        """Имена файлов миниатюр совпадают с get_thumbnail.
+
+        thumbnail_file повторяет расчет имени из закрепленной версии
+        sorl-thumbnail, тест проверяет это для всех вариантов.
+        """
+        post = Post.objects.first()
+        for overrides in (
+            {},
+            {'THUMBNAIL_PRESERVE_FORMAT': True},
+            {'THUMBNAIL_PROGRESSIVE': False, 'THUMBNAIL_ORIENTATION': False},
+        ):
+            for geometry, options in THUMBNAIL_GEOMETRIES:
+                with self.subTest(
+                    geometry=geometry,
+                    format=options['format'],
+                    settings=overrides,
+                ), override_settings(**overrides):
+                    self.assertEqual(
+                        thumbnail_file(post.image, geometry, options).name,
+                        get_thumbnail(post.image, geometry, **options).name,
+                    )
+
+    def test_unprocessed_image_is_not_resized_on_render(self):
+        """До обработки очереди показывается оригинал без обращения к sorl."""
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 600), 'green').save(buffer, 'JPEG')
+        post = Post.objects.create(
+            author=self.user,
+            text='Без миниатюр',
+            image=SimpleUploadedFile('big.jpg', buffer.getvalue()),
+        )
+        with mock.patch('sorl.thumbnail.base.ThumbnailBackend.get_thumbnail') \
+                as get_thumbnail:
+            response = self.client.get(
+                reverse('posts:post_detail', args=(post.pk,))
+            )
+        get_thumbnail.assert_not_called()
+        self.assertContains(response, post.image.url)
+        self.assertContains(response, 'width="1200" height="600"')
+
+    def test_feed_reads_kvstore_once(self):
+        """Миниатюры страницы ленты читаются одним запросом."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        kvstore_queries = [
+            query for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kvstore_queries), 1)
+        variants = preload_thumbnails(Post.objects.all())
+        for post in Post.objects.all():
+            for image in variants[post.pk]['jpeg']:
+                self.assertContains(response, image.url)
+
+    def test_picture_has_srcset_and_size(self):
+        """Картинка отдается в WebP и JPEG с размерами из kvstore."""
+        post = Post.objects.first()
+        response = self.client.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        )
+        self.assertContains(response, 'type="image/webp"')
+        for width in IMAGE_WIDTHS:
+            self.assertContains(response, f' {width}w', count=2)
+        self.assertContains(response, 'width="960" height="339"')
+
+
+class PostDetailCommentsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:post_detail', args=(self.post.id,))
+
+    def add_comments(self, count):
+        start = Comment.objects.count()
+        for i in range(start, start + count):
+            author = User.objects.create_user(username=f'commentator{i}')
+            Comment.objects.create(
+                post=self.post,
+                author=author,
+                text=f'Комментарий {i}',
+            )
+
+    def test_post_detail_queries_do_not_grow(self):
+        """Число запросов не зависит от числа комментариев."""
+        self.add_comments(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.add_comments(5)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(self.url)
+
+    def test_comments_are_paginated(self):
+        """Комментарии выводятся постранично."""
+        self.add_comments(NUMB_OF_COMMENTS + 1)
+        comments = self.client.get(self.url).context['comments']
+        self.assertEqual(len(comments), NUMB_OF_COMMENTS)
+        self.assertEqual(comments[0].text, 'Комментарий 0')
+        response = self.client.get(
+            self.url + f'?after={comments.next_cursor}'
+        )
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            [f'Комментарий {NUMB_OF_COMMENTS}'],
+        )
+
+
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.relevant = Post.objects.create(
+            author=cls.user,
+            text='Кошки, кошки и еще раз кошки',
+            group=cls.group,
+        )
+        cls.mention = Post.objects.create(
+            author=cls.other,
+            text='Собаки лучше, чем кошки, но это неточно',
+        )
+        Post.objects.create(author=cls.user, text='Про погоду')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **params):
+        response = self.client.get(reverse('posts:search'), params)
+
+        return list(response.context['page_obj'])
+
+    def test_search_ranks_results(self):
+        """Поиск находит посты по словам, релевантные первыми."""
+        self.assertEqual(self.search(q='КОШКИ'), [self.relevant, self.mention])
+        self.assertEqual(self.search(q='кош соба'), [self.mention])
+
+    def test_search_filters(self):
+        """Результаты поиска фильтруются по группе и автору."""
+        self.assertEqual(
+            self.search(q='кошки', group=self.group.slug),
+            [self.relevant],
+        )
+        self.assertEqual(
+            self.search(q='кошки', author=self.other.username),
+            [self.mention],
+        )
+
+    def test_unknown_filter_finds_nothing(self):
+        """Неизвестные группа или автор не отбрасывают фильтр."""
+        self.assertEqual(self.search(q='кошки', group='missing'), [])
+        self.assertEqual(self.search(q='кошки', author='missing'), [])
+
+    @mock.patch('posts.views.SEARCH_LIMIT', 1)
+    def test_truncated_count_is_marked(self):
+        """Число результатов сверх лимита показывается с плюсом."""
+        response = self.client.get(reverse('posts:search'), {'q': 'кошки'})
+        self.assertEqual(list(response.context['page_obj']), [self.relevant])
+        self.assertContains(response, 'Найдено записей: 1+')
+
+    def test_admin_search_is_not_limited(self):
+        """Поиск в админке не ограничен SEARCH_LIMIT."""
+        self.assertEqual(
+            set(filter_posts(Post.objects.all(), 'кошки')),
+            {self.relevant, self.mention},
+        )
+
+    def test_search_index_follows_edits(self):
+        """Индекс обновляется при изменении и удалении поста."""
+        post = Post.objects.create(author=self.user, text='Черновик')
+        post.text = 'Чистовик'
+        post.save()
+        self.assertEqual(self.search(q='черновик'), [])
+        self.assertEqual(self.search(q='чистовик'), [post])
+        post.delete()
+        self.assertEqual(self.search(q='чистовик'), [])
+
+    def test_rebuild_search_index(self):
+        """Команда rebuild_search_index восстанавливает индекс."""
+        unindex_posts(Post.objects.values_list('pk', flat=True))
+        self.assertEqual(self.search(q='кошки'), [])
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.search(q='кошки'), [self.relevant, self.mention])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaServingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.name = f'posts/ab/cd/{"a" * 64}.jpg'
+        cls.content = bytes(range(256)) * 4
+        path = os.path.join(TEMP_MEDIA_ROOT, cls.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(cls.content)
+        cls.url = f'{settings.MEDIA_URL}{cls.name}'
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_file_is_served_with_validators(self):
+        """Файл отдается целиком с ETag и неизменяемым кэшированием."""
+        response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(
+            self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=response['ETag'],
+            ).status_code,
+            304,
+        )
+        self.assertEqual(
+            self.client.get(
+                self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+            ).status_code,
+            304,
+        )
+
+    def test_range_requests(self):
+        """Поддерживаются запросы части файла."""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(
+            b''.join(response.streaming_content), self.content[10:20],
+        )
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(
+            b''.join(response.streaming_content), self.content[-4:],
+        )
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_range(self):
+        """If-Range принимает ETag и дату изменения файла."""
+        validators = self.client.get(self.url)
+        for if_range, status in (
+            (validators['ETag'], 206),
+            (validators['Last-Modified'], 206),
+            ('"stale"', 200),
+            ('Mon, 01 Jan 2001 00:00:00 GMT', 200),
+        ):
+            with self.subTest(if_range=if_range):
+                response = self.client.get(
+                    self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=if_range,
+                )
+                self.assertEqual(response.status_code, status)
+
+    def test_missing_and_outside_files(self):
+        """Несуществующие, скрытые файлы и пути вне MEDIA_ROOT не отдаются."""
+        for name in ('posts/.upload-abc', '.quarantine/posts/orphan.jpg'):
+            path = os.path.join(TEMP_MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(self.content)
+        for url in (
+            f'{settings.MEDIA_URL}posts/missing.jpg',
+            f'{settings.MEDIA_URL}../manage.py',
+            f'{settings.MEDIA_URL}posts/ab',
+            f'{settings.MEDIA_URL}posts/.upload-abc',
+            f'{settings.MEDIA_URL}.quarantine/posts/orphan.jpg',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect')
+    def test_accel_redirect(self):
+        """При настроенном прокси файл отдает nginx."""
+        response = self.client.get(self.url)
+        self.assertEqual(
+            response['X-Accel-Redirect'], f'/protected-media/{self.name}',
+        )
+        self.assertEqual(response.content, b'')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author,
+            text='Тестовый пост',
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+        )
+
+    def etag(self, client, url):
+        return client.get(url)['ETag']
+
+    def test_unchanged_pages_are_not_modified(self):
+        """Неизменившаяся страница отдается с кодом 304."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=self.etag(self.client, url),
+                )
+                self.assertEqual(response.status_code, 304)
+
+    def test_new_comment_changes_pages(self):
+        """Новый комментарий меняет валидаторы страниц с постом."""
+        etags = [self.etag(self.client, url) for url in self.urls]
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий',
+        )
+        for url, old in zip(self.urls, etags):
+            with self.subTest(url=url):
+                self.assertNotEqual(self.etag(self.client, url), old)
+
+    def test_validator_varies_by_user(self):
+        """Гость и пользователь получают разные валидаторы."""
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertNotEqual(
+                    self.etag(self.client, url),
+                    self.etag(self.reader_client, url),
+                )
+
+    def test_follow_changes_profile(self):
+        """Подписка меняет страницу профиля автора."""
+        url = reverse('posts:profile', args=(self.author.username,))
+        guest = self.etag(self.client, url)
+        reader = self.etag(self.reader_client, url)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertNotEqual(self.etag(self.client, url), guest)
+        self.assertNotEqual(self.etag(self.reader_client, url), reader)
+
+    def test_missing_objects_are_not_found(self):
+        """Для несуществующих страниц валидатор не мешает 404."""
+        for url in (
+            reverse('posts:group_list', args=('missing',)),
+            reverse('posts:profile', args=('missing',)),
+            reverse('posts:post_detail', args=(self.post.pk + 100,)),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Первый')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:post_detail', args=(self.post.pk,))
+
+    def test_hit_has_no_queries(self):
+        """Повторный запрос гостя обслуживается без базы."""
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:profile', args=(self.author.username,)),
+        ):
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertEqual(len(queries), 0)
+        first = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(first.content, second.content)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=first['ETag'],
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+    def test_page_key_params(self):
+        """Лишние параметры не плодят копии страницы в кэше."""
+        factory = RequestFactory()
+        index = reverse('posts:index')
+        self.assertEqual(
+            page_key(factory.get(f'{index}?page=1&q=x')),
+            page_key(factory.get(f'{index}?q=x&page=1')),
+        )
+        self.assertNotEqual(
+            page_key(factory.get(index)),
+            page_key(factory.get(f'{index}?page=2')),
+        )
+        self.assertIsNone(page_key(factory.get(f'{index}?utm_source=mail')))
+
+    def test_holes_see_resolved_view(self):
+        """При попадании в кэш фрагменты видят представление страницы."""
+        view_names = []
+
+        def fill(request, content):
+            view_names.append(request.resolver_match.view_name)
+            return fill_holes(request, content)
+
+        self.client.get(self.url)
+        with mock.patch('posts.middleware.fill_holes', fill):
+            self.client.get(self.url)
+        self.assertEqual(view_names, ['posts:post_detail'])
+
+    def test_messages_check_skips_guest_session(self):
+        """Проверка сообщений не читает сессию гостя."""
+        middleware = PageCacheMiddleware(None)
+        request = RequestFactory().get(self.url)
+        request.session = mock.MagicMock(session_key=None)
+        self.assertTrue(middleware.is_cacheable_request(request))
+        request.session.__contains__.assert_not_called()
+        request.COOKIES['messages'] = 'value'
+        self.assertFalse(middleware.is_cacheable_request(request))
+
+    def test_signals_purge_tagged_pages(self):
+        """Изменение поста сбрасывает закэшированные страницы с ним."""
+        index = reverse('posts:index')
+        self.client.get(self.url)
+        self.client.get(index)
+        self.post.text = 'Исправленный'
+        self.post.save()
+        self.assertContains(self.client.get(self.url), 'Исправленный')
+        self.assertContains(self.client.get(index), 'Исправленный')
+
+    def test_holes_are_filled_per_user(self):
+        """Скелет страницы общий, фрагменты свои у каждого пользователя."""
+        reader = User.objects.create_user(username='reader')
+        self.client.get(self.url)
+        author_client = Client()
+        author_client.force_login(self.author)
+        reader_client = Client()
+        reader_client.force_login(reader)
+        with CaptureQueriesContext(connection) as queries:
+            response = author_client.get(self.url)
+        self.assertNotIn('SELECT "posts_post"', str(queries.captured_queries))
+        self.assertContains(response, 'Пользователь: author')
+        self.assertContains(response, 'Редактировать запись')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        response = reader_client.get(self.url)
+        self.assertContains(response, 'Пользователь: reader')
+        self.assertNotContains(response, 'Редактировать запись')
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Пользователь:')
+        self.assertNotContains(response, 'csrfmiddlewaretoken')
+
+    def test_follow_button_hole(self):
+        """Кнопка подписки отражает состояние текущего пользователя."""
+        reader = User.objects.create_user(username='reader')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        url = reverse('posts:profile', args=(self.author.username,))
+        self.assertContains(reader_client.get(url), 'Подписаться')
+        etag = reader_client.get(url)['ETag']
+        Follow.objects.create(user=reader, author=self.author)
+        response = reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Отписаться')
+
+
+class StampedeProtectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_compute_once_while_fresh(self):
+        """Свежее значение не пересчитывается."""
+        compute = mock.Mock(return_value='значение')
+        for _ in range(5):
+            self.assertEqual(cached('key', compute, 60), ('значение', False))
+        compute.assert_called_once()
+
+    def test_expired_value_is_recomputed(self):
+        """После истечения значение пересчитывается."""
+        cached('key', lambda: 'старое', 60)
+        with mock.patch('posts.cache.time', return_value=time() + 61):
+            self.assertEqual(
+                cached('key', lambda: 'новое', 60), ('новое', False),
+            )
+
+    def test_stale_value_while_locked(self):
+        """Пока другой процесс пересчитывает, отдается старое значение."""
+        cached('key', lambda: 'старое', 60, 'stale')
+        compute = mock.Mock(return_value='новое')
+        cache.set_many({'lock:key': 1, 'lock:other': 1})
+        with mock.patch('posts.cache.time', return_value=time() + 61):
+            self.assertEqual(cached('key', compute, 60), ('старое', False))
+        self.assertEqual(
+            cached('other', compute, 60, 'stale'), ('старое', True),
+        )
+        compute.assert_not_called()
+
+    def test_concurrent_misses_compute_once(self):
+        """Одновременные промахи пересчитывают значение один раз."""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            sleep(0.2)
+            return 'значение'
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda _: cached('key', compute, 60), range(4),
+            ))
+        self.assertEqual(results, [('значение', False)] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_page_is_not_cached(self):
+        """Страница из значений прежних версий не кэшируется."""
+        author = User.objects.create_user(username='author')
+        Post.objects.create(author=author, text='Старый пост')
+        index = reverse('posts:index')
+        self.client.get(index)
+        Post.objects.create(author=author, text='Новый пост')
+        add = cache.add
+
+        def locked(key, *args, **kwargs):
+            if key.startswith('lock:'):
+                return False
+            return add(key, *args, **kwargs)
+
+        with mock.patch.object(cache, 'add', locked), \
+                mock.patch('posts.cache.REBUILD_LOCK_TIMEOUT', 0):
+            response = self.client.get(index)
+        self.assertNotContains(response, 'Новый пост')
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertContains(self.client.get(index), 'Новый пост')
+
+    def test_fragment_cache_tag(self):
+        """Фрагмент шаблона рендерится один раз для одного ключа."""
+        template = Template(
+            '{% load fragments %}'
+            '{% fragment_cache 60 feed key stale %}{{ value }}'
+            '{% endfragment_cache %}'
+        )
+        context = {'key': 1, 'stale': 'page', 'value': 'первый'}
+        self.assertEqual(template.render(Context(context)), 'первый')
+        context['value'] = 'второй'
+        self.assertEqual(template.render(Context(context)), 'первый')
+        context['key'] = 2
+        self.assertEqual(template.render(Context(context)), 'второй')
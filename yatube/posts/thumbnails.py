@@ -0,0 +1,148 @@
+import logging
+
+from django.db.models import F
+from django.utils import timezone
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE,
+    KVStore as CachedDbKVStore,
+)
+from sorl.thumbnail.models import KVStore
+
+from .cache import bump_version, post_feeds
+from .constants import THUMBNAIL_GEOMETRIES, THUMBNAIL_MAX_ATTEMPTS
+from .models import Post, ThumbnailTask
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(post):
+    """Постановка поста в очередь генерации миниатюр."""
+    ThumbnailTask.objects.update_or_create(
+        post=post,
+        defaults={'attempts': 0, 'failed': False, 'image': post.image.name},
+    )
+
+
+def generate(post):
+    """Генерация миниатюр поста для всех размеров из шаблонов.
+
+    Готовность отмечается без post_save и только если картинка
+    не сменилась, сбрасываются лишь страницы с постом.
+    """
+    for geometry, options in THUMBNAIL_GEOMETRIES:
+        thumbnail = get_thumbnail(post.image, geometry, **options)
+        if not thumbnail.exists():
+            raise OSError(f'Миниатюра {geometry} для {post.image} не создана')
+    if Post.objects.filter(pk=post.pk, image=post.image.name).update(
+        thumbnails_ready=True,
+        updated=timezone.now(),
+    ):
+        bump_version(
+            *post_feeds(post.author_id, post.group_id), f'post:{post.pk}',
+        )
+
+
+def process_task(post_id):
+    """Обработка задачи очереди, True при успехе.
+
+    Задача удаляется, только если картинка в ней не сменилась: новая
+    загрузка во время обработки оставляет задачу в очереди. После
+    THUMBNAIL_MAX_ATTEMPTS ошибок задача отмечается неисправимой.
+    """
+    image = ThumbnailTask.objects.filter(post_id=post_id).values_list(
+        'image', flat=True,
+    ).first()
+    task = ThumbnailTask.objects.filter(post_id=post_id, image=image)
+    post = Post.objects.filter(pk=post_id).first()
+    try:
+        if post is not None and post.image:
+            generate(post)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры поста %s', post_id)
+        task.update(attempts=F('attempts') + 1)
+        task.filter(attempts__gte=THUMBNAIL_MAX_ATTEMPTS).update(failed=True)
+        return False
+    task.delete()
+
+    return True
+
+
+def thumbnail_file(image, geometry, options):
+    """Файл миниатюры с тем же именем, что вычисляет sorl-thumbnail.
+
+    Имя считается закрытыми методами бэкенда, поэтому версия
+    sorl-thumbnail закреплена в requirements.txt, а совпадение имен
+    проверяется тестом.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+
+    return ImageFile(name, default.storage)
+
+
+def load_thumbnails(files):
+    """Записи kvstore для файлов миниатюр за один запрос к кэшу и базе."""
+    if not isinstance(default.kvstore, CachedDbKVStore):
+        found = {
+            name: default.kvstore.get(file) for name, file in files.items()
+        }
+        return {name: file for name, file in found.items() if file}
+    keys = {name: add_prefix(file.key) for name, file in files.items()}
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(keys.values())
+    missing = set(keys.values()) - values.keys()
+    if missing:
+        stored = dict(
+            KVStore.objects.filter(key__in=missing).values_list('key', 'value')
+        )
+        kv_cache.set_many(
+            stored, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT,
+        )
+        values.update(stored)
+
+    return {
+        name: deserialize_image_file(values[key])
+        for name, key in keys.items()
+        if values.get(key) not in (None, EMPTY_VALUE)
+    }
+
+
+def preload_thumbnails(posts):
+    """Варианты картинок постов страницы по форматам.
+
+    Пост попадает в результат, только если готовы все варианты.
+    """
+    posts = [post for post in posts if post.thumbnails_ready and post.image]
+    files = load_thumbnails({
+        (post.pk, index): thumbnail_file(post.image, geometry, options)
+        for post in posts
+        for index, (geometry, options) in enumerate(THUMBNAIL_GEOMETRIES)
+    })
+    variants = {}
+    for post in posts:
+        formats = {}
+        for index, (_, options) in enumerate(THUMBNAIL_GEOMETRIES):
+            if (post.pk, index) not in files:
+                break
+            formats.setdefault(options['format'].lower(), []).append(
+                files[post.pk, index]
+            )
+        else:
+            variants[post.pk] = formats
+
+    return variants
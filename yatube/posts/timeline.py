@@ -0,0 +1,210 @@
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils.functional import cached_property
+
+from .constants import (
+    FANOUT_MAX_FOLLOWERS,
+    FANOUT_RESUME_FOLLOWERS,
+    FEED_COUNT_TIMEOUT,
+    TIMELINE_LENGTH,
+)
+from .models import FanoutTask, Follow, Post, TimelineEntry, UserCounter
+from .utils import KeysetPaginator
+
+
+def pull_author_ids(user):
+    """Авторы без рассылки, их посты читаются напрямую."""
+    return list(Follow.objects.filter(
+        user=user,
+        author__counter__fanout_pull=True,
+    ).values_list('author_id', flat=True))
+
+
+def is_pulled(author_id):
+    return UserCounter.objects.filter(
+        user_id=author_id, fanout_pull=True,
+    ).exists()
+
+
+def follower_ids(author_id):
+    return list(Follow.objects.filter(
+        author_id=author_id,
+    ).values_list('user_id', flat=True))
+
+
+def wants_pull(counter):
+    """Нужен ли автору режим без рассылки.
+
+    Пороги включения и выключения различаются, чтобы режим
+    не менялся на каждой подписке и отписке у границы.
+    """
+    if counter.fanout_pull:
+        return counter.followers_count > FANOUT_RESUME_FOLLOWERS
+
+    return counter.followers_count > FANOUT_MAX_FOLLOWERS
+
+
+def trim_timelines(user_ids):
+    """Ограничение лент TIMELINE_LENGTH последними постами.
+
+    Все ленты обрезаются одним запросом по порядку (pub_date, post_id),
+    как при чтении.
+    """
+    cutoff = TimelineEntry.objects.filter(
+        user_id=OuterRef('user_id'),
+    ).order_by('-pub_date', '-post_id').values('pub_date')[
+        TIMELINE_LENGTH:TIMELINE_LENGTH + 1
+    ]
+    TimelineEntry.objects.filter(
+        user_id__in=user_ids,
+        pub_date__lte=Subquery(cutoff),
+    ).delete()
+
+
+def deliver(user_ids, posts):
+    """Записи ленты для пар (id, pub_date) постов."""
+    for user_id in user_ids:
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+                for pk, pub_date in posts
+            ],
+            ignore_conflicts=True,
+        )
+    trim_timelines(user_ids)
+
+
+def recent_posts(author_id):
+    return Post.objects.filter(
+        author_id=author_id,
+    ).order_by('-pub_date').values_list('pk', 'pub_date')[:TIMELINE_LENGTH]
+
+
+def fan_out(post):
+    """Доставка нового поста в ленты подписчиков."""
+    if is_pulled(post.author_id):
+        return
+    followers = follower_ids(post.author_id)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+            for user_id in followers
+        ],
+        ignore_conflicts=True,
+    )
+    trim_timelines(followers)
+
+
+def backfill(follow):
+    """Последние посты автора в ленту нового подписчика."""
+    if not is_pulled(follow.author_id):
+        deliver([follow.user_id], recent_posts(follow.author_id))
+
+
+def unfollow(follow):
+    """Удаление постов автора из ленты бывшего подписчика."""
+    TimelineEntry.objects.filter(
+        user_id=follow.user_id,
+        post__author_id=follow.author_id,
+    ).delete()
+
+
+def check_mode(author_id):
+    """Постановка автора в очередь, если пора сменить режим рассылки."""
+    counter = UserCounter.objects.filter(user_id=author_id).first()
+    if counter is not None and wants_pull(counter) != counter.fanout_pull:
+        FanoutTask.objects.get_or_create(author_id=author_id)
+
+
+def switch_mode(author_id):
+    """Смена режима рассылки автора из очереди.
+
+    Без рассылки разосланные записи автора удаляются из лент, чтобы
+    посты не читались дважды. При возврате рассылки последние посты
+    дописываются в ленты всех подписчиков. Записи и режим меняются
+    в одной транзакции, поэтому чтение видит либо старое, либо новое.
+    """
+    with transaction.atomic():
+        FanoutTask.objects.filter(author_id=author_id).delete()
+        counter = UserCounter.objects.select_for_update().filter(
+            user_id=author_id,
+        ).first()
+        if counter is None:
+            return
+        pull = wants_pull(counter)
+        if pull == counter.fanout_pull:
+            return
+        if pull:
+            TimelineEntry.objects.filter(post__author_id=author_id).delete()
+        else:
+            deliver(follower_ids(author_id), list(recent_posts(author_id)))
+        UserCounter.objects.filter(pk=counter.pk).update(fanout_pull=pull)
+
+
+class TimelinePaginator(KeysetPaginator):
+    """Пагинация ленты подписок.
+
+    Ключи (pub_date, post_id) читаются из TimelineEntry пользователя
+    по индексу, посты авторов без рассылки - отдельным запросом,
+    и оба списка сливаются по ключу.
+    """
+
+    def __init__(self, user, per_page, key,
+                 count_timeout=FEED_COUNT_TIMEOUT):
+        super().__init__(user.timeline.all(), per_page, key, count_timeout)
+        self.user = user
+
+    @cached_property
+    def pulled(self):
+        author_ids = pull_author_ids(self.user)
+        if not author_ids:
+            return None
+
+        return Post.objects.filter(author_id__in=author_ids)
+
+    def sources(self):
+        yield self.object_list, 'post_id'
+        if self.pulled is not None:
+            yield self.pulled, 'pk'
+
+    def keys(self, anchor, limit, lookup):
+        """Ключи записей за якорем: lt - дальше по ленте, gt - ближе."""
+        keys = set()
+        for objects, pk_field in self.sources():
+            ordering = ('-pub_date', f'-{pk_field}')
+            if lookup == 'gt':
+                ordering = ('pub_date', pk_field)
+            if anchor is not None:
+                value, pk = anchor
+                objects = objects.filter(
+                    Q(**{f'pub_date__{lookup}': value})
+                    | Q(pub_date=value, **{f'{pk_field}__{lookup}': pk})
+                )
+            keys.update(objects.order_by(*ordering).values_list(
+                'pub_date', pk_field,
+            )[:limit])
+
+        return sorted(keys, reverse=lookup == 'lt')[:limit]
+
+    def posts(self, keys):
+        posts = Post.objects.select_related('author', 'group').in_bulk(
+            [pk for _, pk in keys]
+        )
+
+        return [posts[pk] for _, pk in keys if pk in posts]
+
+    def after(self, anchor, limit):
+        return self.posts(self.keys(anchor, limit, 'lt'))
+
+    def before(self, anchor, limit):
+        return self.posts(self.keys(anchor, limit, 'gt')[::-1])
+
+    def key_after(self, anchor, skip):
+        keys = self.keys(anchor, skip, 'lt')
+        if len(keys) < skip:
+            return None
+
+        return keys[skip - 1]
+
+    def total(self):
+        return sum(objects.count() for objects, _ in self.sources())
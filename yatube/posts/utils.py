@@ -1,9 +1,279 @@
+import base64
+import binascii
+from datetime import datetime
+from hashlib import md5
+
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .cache import cached, get_version, feed_count, mark_stale
+from .constants import (
+    ANCHORS_CACHE_TIMEOUT,
+    FEED_CACHE_TIMEOUT,
+    FEED_COUNT_TIMEOUT,
+    PAGE_WINDOW,
+)
+
+
+def encode_cursor(number, value, pk):
+    """Непрозрачный курсор на запись для страницы number."""
+    raw = f'{number}|{value.isoformat()}|{pk}'
+
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбор курсора, None для испорченного значения."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        number, value, pk = raw.decode().split('|')
+        return int(number), datetime.fromisoformat(value), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class KeysetPaginator(Paginator):
+    """Пагинация по ключу (pub_date, id) без OFFSET.
+
+    Для перехода на произвольную страницу в кэше хранятся якоря -
+    ключ последней записи предыдущей страницы. Число записей берется
+    из кэша и может быть приблизительным.
+    """
+
+    key_field = 'pub_date'
+    descending = True
+    anchors_version = 'posts'
+
+    def __init__(self, object_list, per_page, key,
+                 count_timeout=FEED_COUNT_TIMEOUT):
+        super().__init__(object_list.order_by(*self.ordering), per_page)
+        self.key = key
+        self.count_timeout = count_timeout
+
+    @property
+    def ordering(self):
+        if self.descending:
+            return f'-{self.key_field}', '-pk'
+        return self.key_field, 'pk'
+
+    @cached_property
+    def count(self):
+        return feed_count(self.key, self.total, self.count_timeout)
+
+    def total(self):
+        return self.object_list.count()
+
+    def page_window(self, number):
+        """Номера страниц вокруг текущей."""
+        return range(
+            max(number - PAGE_WINDOW, 1),
+            min(number + PAGE_WINDOW, self.num_pages) + 1,
+        )
+
+    @property
+    def anchors_key(self):
+        return f'anchors:{self.key}:{get_version(self.anchors_version)}'
+
+    def get_anchors(self):
+        if not hasattr(self, '_anchors'):
+            self._anchors = dict(cache.get(self.anchors_key) or {})
+        return self._anchors
+
+    def remember_anchor(self, number, anchor):
+        anchors = self.get_anchors()
+        if anchors.get(number) != anchor:
+            anchors[number] = anchor
+            cache.set(self.anchors_key, anchors, ANCHORS_CACHE_TIMEOUT)
+
+    def anchor_of(self, obj):
+        return getattr(obj, self.key_field), obj.pk
+
+    def beyond(self, anchor, lookup):
+        value, pk = anchor
+        return self.object_list.filter(
+            Q(**{f'{self.key_field}__{lookup}': value})
+            | Q(**{self.key_field: value, f'pk__{lookup}': pk})
+        )
+
+    def following(self, anchor):
+        """Записи после якоря в порядке пагинации."""
+        return self.beyond(anchor, 'lt' if self.descending else 'gt')
+
+    def preceding(self, anchor):
+        """Записи до якоря в порядке пагинации."""
+        return self.beyond(anchor, 'gt' if self.descending else 'lt')
+
+    def after(self, anchor, limit):
+        """Записи после якоря, без якоря - с начала."""
+        objects = self.object_list
+        if anchor is not None:
+            objects = self.following(anchor)
+
+        return list(objects[:limit])
+
+    def before(self, anchor, limit):
+        """Записи перед якорем, без якоря - с конца."""
+        objects = self.object_list
+        if anchor is not None:
+            objects = self.preceding(anchor)
+
+        return list(objects.reverse()[:limit])[::-1]
+
+    def key_after(self, anchor, skip):
+        """Ключ записи номер skip после якоря."""
+        objects = self.object_list
+        if anchor is not None:
+            objects = self.following(anchor)
+        try:
+            return objects.values_list(self.key_field, 'pk')[skip - 1]
+        except IndexError:
+            return None
+
+    def find_anchor(self, number):
+        """Якорь страницы number от ближайшего известного якоря."""
+        anchors = self.get_anchors()
+        known = max((n for n in anchors if n < number), default=1)
+        anchor = self.key_after(
+            anchors.get(known) if known > 1 else None,
+            (number - known) * self.per_page,
+        )
+        if anchor is not None:
+            self.remember_anchor(number, anchor)
+
+        return anchor
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if number == 1:
+            return self.build_page(self.after(None, self.per_page), 1)
+        anchor = self.get_anchors().get(number)
+        if anchor is None and number < self.num_pages:
+            anchor = self.find_anchor(number)
+        if anchor is None:
+            object_list = self.tail(number)
+        else:
+            object_list = self.after(anchor, self.per_page)
+
+        return self.build_page(object_list, number)
+
+    def tail(self, number):
+        """Последняя страница читается с конца."""
+        tail = self.count - (number - 1) * self.per_page
+
+        return self.before(None, min(max(tail, 1), self.per_page))
+
+    def cursor_page(self, after=None, before=None):
+        """Страница, соседняя с записью из курсора."""
+        cursor = decode_cursor(after or before)
+        if cursor is None:
+            return self.get_page(1)
+        number, value, pk = cursor
+        number = min(max(number, 1), self.num_pages)
+        anchor = (value, pk)
+        if after:
+            object_list = self.after(anchor, self.per_page)
+        else:
+            object_list = self.before(anchor, self.per_page)
+
+        return self.build_page(object_list, number, remember=False)
+
+    def build_page(self, object_list, number, remember=True):
+        """Страница из готовых записей.
+
+        Якорь следующей страницы запоминается, только если записи
+        выбраны сервером по номеру страницы: курсор приходит от клиента
+        и может быть подделан или устареть.
+        """
+        page = self._get_page(object_list, number, self)
+        page.next_cursor = page.previous_cursor = None
+        page.page_window = self.page_window(number)
+        if object_list and page.has_next():
+            anchor = self.anchor_of(object_list[-1])
+            if remember:
+                self.remember_anchor(number + 1, anchor)
+            page.next_cursor = encode_cursor(number + 1, *anchor)
+        if object_list and page.has_previous():
+            page.previous_cursor = encode_cursor(
+                number - 1, *self.anchor_of(object_list[0])
+            )
+
+        return page
+
+
+class CommentPaginator(KeysetPaginator):
+    """Пагинация комментариев поста по ключу (created, id).
+
+    Новые комментарии попадают в конец и не сдвигают границы страниц,
+    поэтому якоря сбрасываются только при удалении.
+    """
+
+    key_field = 'created'
+    descending = False
+
+    def __init__(self, post, per_page):
+        super().__init__(
+            post.comments.select_related('author'),
+            per_page,
+            f'comments:{post.pk}',
+        )
+        self.anchors_version = f'comments:{post.pk}'
+        self.post = post
+
+    @cached_property
+    def count(self):
+        return self.post.comments_count
+
+
+def paginator_get_page(request, posts, numb_of_posts, key,
+                       count_timeout=FEED_COUNT_TIMEOUT, cache_key=None):
+    """Пагинация.
+
+    С cache_key записи страницы берутся из кэша через cached, и при
+    истечении их пересчитывает только один запрос.
+    """
+    paginator = KeysetPaginator(posts, numb_of_posts, key, count_timeout)
+
+    return cached_page(request, paginator, cache_key)
+
+
+def cached_page(request, paginator, cache_key=None):
+    """Страница пагинатора, с cache_key - записи из кэша."""
+    if cache_key is None:
+        return request_page(request, paginator)
+    key = paginator.key
+    query = request.GET.urlencode()
+
+    def compute():
+        page = request_page(request, paginator)
+        return list(page.object_list), page.number
+
+    (object_list, number), stale = cached(
+        f'feed_page:{key}:{md5(f"{cache_key}|{query}".encode()).hexdigest()}',
+        compute,
+        FEED_CACHE_TIMEOUT,
+        f'feed_page:{key}:{md5(query.encode()).hexdigest()}',
+    )
+
+    if stale:
+        mark_stale(request)
+
+    return paginator.build_page(
+        object_list,
+        number,
+        remember=not (
+            stale or request.GET.get('after') or request.GET.get('before')
+        ),
+    )
 
 
-def paginator_get_page(request, posts, numb_of_posts):
-    """Пагинация."""
-    paginator = Paginator(posts, numb_of_posts)
+def request_page(request, paginator):
+    """Страница по параметрам запроса page, after или before."""
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before:
+        return paginator.cursor_page(after=after, before=before)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
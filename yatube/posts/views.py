@@ -1,12 +1,61 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db import transaction
 
 from .models import Post, Group, User, Follow
 from .forms import PostForm, CommentForm
-from .utils import paginator_get_page
-from .constants import NUMB_OF_POSTS
+from .cache import feed_cache, tagged_page
+from .utils import (
+    CommentPaginator,
+    cached_page,
+    paginator_get_page,
+    request_page,
+)
+from .search import search_post_ids
+from .timeline import TimelinePaginator
+from .constants import (
+    NUMB_OF_POSTS,
+    NUMB_OF_COMMENTS,
+    FOLLOW_COUNT_TIMEOUT,
+    SEARCH_LIMIT,
+)
 
 
+def index_tags(request):
+    return ['index']
+
+
+def group_tags(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True,
+    ).first()
+    if group_id is None:
+        return None
+
+    return [f'group:{group_id}']
+
+
+def profile_tags(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True,
+    ).first()
+    if author_id is None:
+        return None
+    return [f'profile:{author_id}', f'author:{author_id}']
+
+
+def post_tags(request, post_id):
+    author_id = Post.objects.filter(pk=post_id).values_list(
+        'author_id', flat=True,
+    ).first()
+    if author_id is None:
+        return None
+
+    return [f'post:{post_id}', f'author:{author_id}']
+
+
+@tagged_page(index_tags)
 def index(request):
     """Главная страница."""
     template = 'posts/index.html'
@@ -14,54 +63,73 @@ def index(request):
         'author',
         'group',
     )
+    keys = feed_cache(request, 'index')
     context = {
         'index': True,
-        'page_obj': paginator_get_page(request, posts, NUMB_OF_POSTS),
+        'page_obj': paginator_get_page(
+            request, posts, NUMB_OF_POSTS, 'index',
+            cache_key=keys['feed_key'],
+        ),
+        **keys,
     }
 
     return render(request, template, context)
 
 
+@tagged_page(group_tags)
 def group_posts(request, slug):
     """Страница с группами."""
     group = get_object_or_404(Group, slug=slug)
     template = 'posts/group_list.html'
-    posts = group.posts.all()
+    posts = group.posts.select_related('author')
+    keys = feed_cache(request, f'group:{group.pk}')
     context = {
         'group': group,
-        'page_obj': paginator_get_page(request, posts, NUMB_OF_POSTS),
+        'page_obj': paginator_get_page(
+            request, posts, NUMB_OF_POSTS, f'group:{group.pk}',
+            cache_key=keys['feed_key'],
+        ),
+        **keys,
     }
 
     return render(request, template, context)
 
 
+@tagged_page(profile_tags)
 def profile(request, username):
     """Страница профайла пользователя."""
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(
-            user=request.user.id,
-            author=author.id,
-        ).exists()
-    else:
-        following = False
+    author = get_object_or_404(
+        User.objects.select_related('counter'),
+        username=username,
+    )
+    posts = author.posts.select_related('group')
+    keys = feed_cache(request, f'profile:{author.pk}')
     context = {
-        'page_obj': paginator_get_page(request, posts, NUMB_OF_POSTS),
+        'page_obj': paginator_get_page(
+            request, posts, NUMB_OF_POSTS, f'profile:{author.pk}',
+            cache_key=keys['feed_key'],
+        ),
         'author': author,
-        'following': following,
+        **keys,
     }
 
     return render(request, template, context)
 
 
+@tagged_page(post_tags)
 def post_detail(request, post_id):
     """Страница поста."""
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__counter', 'group'),
+        id=post_id,
+    )
     form = CommentForm()
-    comments = post.comments.all()
+    comments = request_page(
+        request,
+        CommentPaginator(post, NUMB_OF_COMMENTS),
+    )
     context = {
         'post': post,
         'form': form,
@@ -71,11 +139,50 @@ def post_detail(request, post_id):
     return render(request, template, context)
 
 
+def search(request):
+    """Поиск по постам.
+
+    Неизвестные группа или автор в фильтре дают пустой результат.
+    """
+    template = 'posts/search.html'
+    query = request.GET.get('q', '')
+    group_slug = request.GET.get('group', '')
+    author_name = request.GET.get('author', '')
+    group = Group.objects.filter(slug=group_slug).first()
+    author = User.objects.filter(username=author_name).first()
+    post_ids = []
+    if (group or not group_slug) and (author or not author_name):
+        post_ids = search_post_ids(query, group, author, SEARCH_LIMIT + 1)
+    paginator = Paginator(post_ids[:SEARCH_LIMIT], NUMB_OF_POSTS)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        page_obj.object_list
+    )
+    page_obj.object_list = [
+        posts[pk] for pk in page_obj.object_list if pk in posts
+    ]
+    params = request.GET.copy()
+    params.pop('page', None)
+    context = {
+        'page_obj': page_obj,
+        'query': query,
+        'group': group,
+        'author': author,
+        'author_name': author_name,
+        'truncated': len(post_ids) > SEARCH_LIMIT,
+        'groups': Group.objects.all(),
+        'query_string': params.urlencode(),
+    }
+
+    return render(request, template, context)
+
+
 @login_required
+@transaction.atomic
 def post_create(request):
     """Создание нового поста."""
     template = 'posts/post_create.html'
-    form = PostForm(request.POST)
+    form = PostForm(request.POST, files=request.FILES or None)
     if request.method == 'POST' and form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
@@ -92,6 +199,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     """Редактирование поста."""
     template = 'posts/post_create.html'
@@ -122,6 +230,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     """Добавление комментария."""
     post = get_object_or_404(Post, pk=post_id)
@@ -138,16 +247,24 @@ def add_comment(request, post_id):
 @login_required
 def follow_index(request):
     """Подписки пользователя."""
-    posts = Post.objects.filter(author__following__user=request.user)
+    paginator = TimelinePaginator(
+        request.user,
+        NUMB_OF_POSTS,
+        f'follow:{request.user.pk}',
+        FOLLOW_COUNT_TIMEOUT,
+    )
+    keys = feed_cache(request, f'follow:{request.user.pk}', 'index')
     context = {
         'follow': True,
-        'page_obj': paginator_get_page(request, posts, NUMB_OF_POSTS),
+        'page_obj': cached_page(request, paginator, keys['feed_key']),
+        **keys,
     }
 
     return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     """Подписка на пользователя."""
     author = get_object_or_404(User, username=username)
@@ -159,6 +276,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     """Отписка от пользователя."""
     author = get_object_or_404(User, username=username)
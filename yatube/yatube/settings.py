@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -10,6 +11,11 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# 'X-Accel-Redirect' для nginx или 'X-Sendfile' для Apache и lighttpd.
+MEDIA_SENDFILE_HEADER = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_MAX_AGE = 60 * 60
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
 
 ALLOWED_HOSTS = [
     'localhost',
@@ -18,12 +24,37 @@ ALLOWED_HOSTS = [
     'testserver',
 ]
 
+# Локальный LRU каждого процесса перед общим кэшем в файле SQLite.
+# Путь к файлу задается в YATUBE_CACHE_PATH, по умолчанию он вне проекта.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'LOCAL_TIMEOUT': 5,
+            'LOCAL_MAX_ENTRIES': 1000,
+            'STATS': True,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.environ.get(
+            'YATUBE_CACHE_PATH',
+            os.path.join(tempfile.gettempdir(), 'yatube', 'cache.sqlite3'),
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'STATS': True,
+        },
+        # Тесты пишут в отдельный временный файл, см. core.test_runner.
+        'TEST': {
+            'LOCATION': None,
+        },
     }
 }
 
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -40,15 +71,48 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'posts.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Server-Timing для всех, иначе только для сотрудников.
+SERVER_TIMING_HEADER = DEBUG
+# Запросы дольше этого, секунды, пишутся в журнал как WARNING.
+SERVER_TIMING_SLOW = 0.5
+
+# Запросы к базе дольше этого, секунды, пишутся в журнал
+# и в отчет slow_queries за последние SLOW_QUERY_WINDOW секунд.
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_WINDOW = 60 * 60 * 24
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.middleware': {
+            'handlers': ['console'],
+            # WARNING - только медленные запросы, INFO - каждый запрос.
+            'level': 'WARNING',
+        },
+        'core.slow_queries': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')